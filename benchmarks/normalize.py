@@ -0,0 +1,101 @@
+import argparse
+import os
+import re
+import sys
+import time
+
+import datetime as dt
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from rightmove import RightmovePropertiesForSale  # noqa: E402
+from zoopla import ZooplaPropertiesForSale  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PORTALS = {"rightmove": RightmovePropertiesForSale, "zoopla": ZooplaPropertiesForSale}
+
+
+def raw_records(history, portal: str):
+    # Turn normalized history back into the strings the page extractor produces
+    added_on = pd.to_datetime(history["added_on"], errors="coerce")
+    if portal == "rightmove":
+        added_on = "Added on " + added_on.dt.strftime("%d/%m/%Y")
+    else:
+        added_on = added_on.dt.day.astype("Int64").astype(str) + "th " + added_on.dt.strftime("%b %Y")
+
+    return pd.DataFrame({
+        "price": "£" + history["price"].map("{:,.0f}".format, na_action="ignore"),
+        "type": "\n                " + history["type"].astype(str) + "\n            ",
+        "address": history["address"],
+        "url": history["url"],
+        "added_on": added_on,
+        "search_datetime": history["search_datetime"],
+    })
+
+
+def legacy_normalize(results, portal: str):
+    # The per-portal normalization this benchmark replaced, kept as the baseline
+    results["price"].replace(regex=True, inplace=True, to_replace=r"\D", value=r"")
+    results["price"] = pd.to_numeric(results["price"])
+
+    postcode_regex = r"\b([A-Za-z][A-Za-z]?[0-9][0-9]?[A-Za-z]?)\b"
+    results["address"] = results["address"].astype(str)
+    results["postcode"] = results["address"].str.extract(postcode_regex, expand=True)
+
+    no_of_bedroom_regex = r"\b([\d][\d]?)\b"
+    results["number_bedrooms"] = results["type"].astype(str).str.extract(no_of_bedroom_regex, expand=True)
+    results.loc[results["type"].astype(str).str.contains("studio", case=False), "number_bedrooms"] = 0
+    results["number_bedrooms"] = pd.to_numeric(results["number_bedrooms"])
+
+    if portal == "rightmove":
+        today = dt.datetime.now().strftime("%d/%m/%Y")
+        yesterday = (dt.datetime.today() - dt.timedelta(days=1)).strftime("%d/%m/%Y")
+        results["added_on"] = results["added_on"].astype(str).str.replace('today', today)
+        results["added_on"] = results["added_on"].astype(str).str.replace('yesterday', yesterday)
+        results["added_on"] = results["added_on"].astype(str).str.extract(r"\b([0-9]{1,2}\/[0-9]{1,2}\/[0-9]{1,4})\b", expand=True)
+    else:
+        results["added_on"] = results["added_on"].astype(str).str.replace(re.compile(r"(?<=\d)(st|nd|rd|th)"), '')
+        results["added_on"] = pd.to_datetime(results["added_on"], format="%d %b %Y", errors="coerce")
+
+    results["type"] = results["type"].astype(str).str.strip("\n").str.strip()
+    results["search_datetime"] = results["search_datetime"].astype('str')
+    results["added_on"] = results["added_on"].astype('str')
+    results.sort_values("added_on", ascending=False, inplace=True)
+
+    return results
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(portal: str, copies: int, repeat: int):
+    history = pd.read_csv(os.path.join(ROOT, f"{portal}-houses.csv"))
+    raw = pd.concat([raw_records(history, portal)] * copies, ignore_index=True)
+
+    legacy = best_of(lambda: legacy_normalize(raw.copy(), portal), repeat)
+    current = best_of(lambda: PORTALS[portal].normalizer.normalize(raw), repeat)
+
+    # How often the new rules disagree with what history recorded, to catch regressions in the rules themselves
+    normalized = PORTALS[portal].normalizer.normalize(raw_records(history, portal)).sort_index()
+    postcodes = (normalized["postcode"].fillna("") != history["postcode"].fillna("")).sum()
+    bedrooms = (normalized["number_bedrooms"] != history["number_bedrooms"]).sum()
+
+    print(f"{portal:<10} {len(raw):>9,} rows  legacy {legacy * 1000:8.1f}ms  shared {current * 1000:8.1f}ms  "
+          f"speedup {legacy / current:4.1f}x  postcode changes {postcodes}  bedroom changes {bedrooms}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time listing normalization on the historical CSVs")
+    parser.add_argument("--copies", type=int, default=10, help="Repeat each history this many times")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for name in PORTALS:
+        run(name, args.copies, args.repeat)
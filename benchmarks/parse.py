@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import synthetic  # noqa: E402
+from crawler import ParsePool, parse_page  # noqa: E402
+from rightmove import RightmovePropertiesForSale  # noqa: E402
+from zoopla import ZooplaPropertiesForSale  # noqa: E402
+
+
+def recorded_pages(directory: str):
+    # Fixtures in the layout REPLAY_MODE=record writes: an index.json of url -> file name
+    with open(os.path.join(directory, "index.json")) as index_file:
+        index = json.load(index_file)
+
+    searches = {"rightmove": RightmovePropertiesForSale("recorded"), "zoopla": ZooplaPropertiesForSale("recorded")}
+    pages = []
+    for url, name in sorted(index.items()):
+        with open(os.path.join(directory, name), "rb") as fixture:
+            pages.append((searches["rightmove" if "rightmove" in url else "zoopla"], fixture.read()))
+    return pages
+
+
+def record_synthetic(rows: int):
+    directory = tempfile.mkdtemp()
+    index = {}
+    for portal in ("rightmove", "zoopla"):
+        for number, page in enumerate(synthetic.pages(synthetic.history(rows // 2, portal, seed=1), portal)):
+            name = f"{portal}-{number}.html"
+            index[f"https://www.{portal}.co.uk/synthetic?page={number}"] = name
+            with open(os.path.join(directory, name), "wb") as fixture:
+                fixture.write(page)
+
+    with open(os.path.join(directory, "index.json"), "w") as index_file:
+        json.dump(index, index_file)
+    return directory
+
+
+def run(pages, workers: int, fetchers: int, latency: float, max_pending: int):
+    # Fetch threads sleep for the network latency, then either parse inline or hand the bytes to the parse pool
+    pool = ParsePool(workers, max_pending) if workers else None
+    started = time.perf_counter()
+
+    def fetch(page):
+        search, content = page
+        time.sleep(latency)
+        return pool.submit(search, content) if pool else parse_page(type(search), content)
+
+    with ThreadPoolExecutor(max_workers=fetchers) as executor:
+        results = list(executor.map(fetch, pages))
+    rows = sum(len(result.result()[2] if pool else result[2]) for result in results)
+    elapsed = time.perf_counter() - started
+
+    if pool:
+        pool.close()
+    return elapsed, rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time fetching and parsing recorded result pages with a pool of parser processes")
+    parser.add_argument("--pages", help="recorded fixture directory, e.g. fixtures/pages; synthetic pages are recorded if omitted")
+    parser.add_argument("--synthetic-rows", type=int, default=20_000)
+    parser.add_argument("--copies", type=int, default=1, help="parse every recorded page this many times")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4], help="parser processes; 0 parses in the fetch threads")
+    parser.add_argument("--fetchers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per request")
+    parser.add_argument("--max-pending", type=int, default=16)
+    args = parser.parse_args()
+
+    pages = recorded_pages(args.pages or record_synthetic(args.synthetic_rows)) * args.copies
+    print(f"{len(pages)} pages, {sum(len(content) for _, content in pages) / 1e6:.1f} MB, {os.cpu_count()} cores")
+
+    for workers in args.workers:
+        elapsed, rows = run(pages, workers, args.fetchers, args.latency, args.max_pending)
+        print(f"workers {workers:>2}  {elapsed:8.2f}s  {len(pages) / elapsed:8.1f} pages/s  {rows / elapsed:10,.0f} rows/s")
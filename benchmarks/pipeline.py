@@ -0,0 +1,90 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import columnar  # noqa: E402
+import synthetic  # noqa: E402
+from crawler import CrawlScheduler  # noqa: E402
+from digest import DigestRenderer  # noqa: E402
+from history import ListingIndex, merge_history  # noqa: E402
+from matching import ListingMatcher  # noqa: E402
+from parse import Parser  # noqa: E402
+from rightmove import RightmovePropertiesForSale  # noqa: E402
+from zoopla import ZooplaPropertiesForSale  # noqa: E402
+
+
+class Timer:
+
+    def __init__(self, rows: int):
+        self.rows = rows
+        self.results = []
+
+    def stage(self, name, function, rows=None):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        self.results.append({"history_rows": self.rows, "stage": name, "rows": rows or self.rows, "seconds": round(elapsed, 4)})
+        print(f"{self.rows:>9,} {name:<18} {rows or self.rows:>9,} rows {elapsed:>9.3f}s", flush=True)
+        return result
+
+
+def run(rows: int, max_scrape_rows: int, new_fraction: float):
+    timer = Timer(rows)
+    # Both portals are generated from the same seed, so most houses appear on both as they do in practice
+    rightmove_history = synthetic.history(rows // 2, "rightmove", seed=1)
+    zoopla_history = synthetic.history(rows // 2, "zoopla", seed=1)
+
+    # The scrape stages replay synthetic result pages; huge histories are capped to keep the HTML in memory bounded
+    scraped = min(rows, max_scrape_rows)
+    session = synthetic.SyntheticSession(rightmove_history.head(scraped // 2), zoopla_history.head(scraped // 2))
+    crawler = CrawlScheduler(default_limit=(8, 0), session_factory=lambda host: session)
+    searches = [RightmovePropertiesForSale("REGION^0"), ZooplaPropertiesForSale("synthetic")]
+
+    listings = timer.stage("fetch", lambda: crawler.crawl(searches), scraped)
+    records = timer.stage("parse", lambda: [list(search_listings) for search_listings in listings], scraped)
+    rightmove, zoopla = timer.stage("normalize", lambda: (
+        RightmovePropertiesForSale.normalizer.normalize(Parser.create_data_frame(records[0])),
+        ZooplaPropertiesForSale.normalizer.normalize(Parser.create_data_frame(records[1])),
+    ), scraped)
+
+    timer.stage("merge", lambda: ListingMatcher().match(rightmove, zoopla), scraped)
+
+    new_rows = max(int(rows * new_fraction), 1)
+    new_properties = synthetic.history(new_rows, "rightmove", seed=3)
+    timer.stage("dedupe (full)", lambda: merge_history(rightmove_history, new_properties), rows // 2)
+
+    index = ListingIndex("rightmove")
+    index.update(rightmove_history, ["2023-01"] * len(rightmove_history))
+    timer.stage("dedupe (index)", lambda: index.classify(new_properties), new_rows)
+
+    timer.stage("serialize (csv)", lambda: rightmove_history.to_csv(index=False), rows // 2)
+    timer.stage("serialize (feather)", lambda: columnar.to_bytes(rightmove_history), rows // 2)
+
+    digest = ListingMatcher.merge(new_properties, rightmove.iloc[0:0], ListingMatcher().match(new_properties, rightmove.iloc[0:0]))
+    timer.stage("email render", lambda: DigestRenderer().render(digest), new_rows)
+
+    return timer.results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time each stage of the nightly pipeline on synthetic histories")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--max-scrape-rows", type=int, default=100_000)
+    parser.add_argument("--new-fraction", type=float, default=0.01, help="share of the history that is new each night")
+    parser.add_argument("--output", help="write the results as JSON, e.g. to compare before and after a change")
+    args = parser.parse_args()
+
+    results = list(itertools.chain.from_iterable(run(rows, args.max_scrape_rows, args.new_fraction) for rows in args.rows))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    print(pd.DataFrame(results).pivot(index="stage", columns="history_rows", values="seconds").to_string())
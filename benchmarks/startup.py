@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def probe(src: str):
+    # Runs in a fresh interpreter so every measurement is a genuine cold start
+    sys.path.insert(0, src)
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    modules = len(sys.modules)
+
+    # App Engine starts an instance with /_ah/start (or /_ah/warmup) before routing traffic to it, so that comes first;
+    # the first request then only pays for what warmup leaves lazy, such as loading the rollups
+    client = main.app.test_client()
+    get(client, "/_ah/start")
+    warmed = time.perf_counter()
+    get(client, "/analytics/prices")
+    first_request = time.perf_counter()
+
+    print(json.dumps({
+        "import": imported - started,
+        "warmup": warmed - imported,
+        "first_request": first_request - warmed,
+        "modules": modules,
+    }))
+    os._exit(0)
+
+
+def get(client, path: str):
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}")
+
+
+def measure(src: str, repeat: int):
+    # Replay mode keeps the first request and warmup off the network: the repository and email client are local stand-ins
+    directory = tempfile.mkdtemp()
+    env = {**os.environ, "ENVIRONMENT": "benchmark", "REPLAY_MODE": "replay", "REPLAY_DIR": directory, "HTTP_CACHE_PATH": ""}
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe", src],
+                                env=env, cwd=directory, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time a cold start: importing the app, the warmup request and the first request")
+    parser.add_argument("--src", nargs="+", default=[os.path.join(ROOT, "src")],
+                        help="source trees to compare, e.g. one checked out with `git worktree add` at an older commit")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--probe", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe)
+
+    for src in args.src:
+        result = measure(os.path.abspath(src), args.repeat)
+        print(f"{src}\n  import {result['import'] * 1000:8.1f}ms  warmup {result['warmup'] * 1000:8.1f}ms  "
+              f"first request {result['first_request'] * 1000:8.1f}ms  modules imported {result['modules']:.0f}")
@@ -0,0 +1,98 @@
+import datetime as dt
+import html
+import types
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+STREETS = ["Torrington Road", "Fairfields Crescent", "Crummock Gardens", "Lyndhurst Road", "High Street", "Station Approach",
+           "Park Avenue", "Church Lane", "Manor Close", "The Green", "Victoria Drive", "Kings Way"]
+TOWNS = ["Ruislip", "Pinner", "Northwood", "Barnet", "Maidenhead", "Chesham", "Amersham", "Burnham", "Kingsbury", "Finchley"]
+AREAS = ["HA", "EN", "SL", "HP", "NW", "N", "WD", "UB"]
+TYPES = ["terraced house", "semi-detached house", "detached house", "end of terrace house", "bungalow"]
+
+
+def history(rows: int, portal: str = "rightmove", seed: int = 0, days: int = 730):
+    rng = np.random.default_rng(seed)
+    # Postcode and street cardinality grow with the history so blocking behaves like real, sparse address data
+    districts = pd.Series(rng.integers(0, max(rows // 500, 10), rows))
+    postcodes = districts.map(lambda n: f"{AREAS[n % len(AREAS)]}{n // len(AREAS) + 1}")
+    towns = districts.map(lambda n: TOWNS[n % len(TOWNS)])
+    streets = pd.Series(rng.choice(STREETS, rows)) + pd.Series(rng.integers(0, max(rows // 20, 1), rows)).map(lambda n: f" {n}" if n else "")
+    bedrooms = rng.integers(1, 6, rows)
+    added_on = pd.Timestamp("2023-01-01") - pd.to_timedelta(rng.integers(0, days, rows), unit="D")
+    ids = rng.choice(np.arange(10_000_000, 10_000_000 + rows * 10), rows, replace=False).astype(str)
+
+    if portal == "rightmove":
+        urls = "https://www.rightmove.co.uk/properties/" + pd.Series(ids) + "#/?channel=RES_BUY"
+        titles = pd.Series(bedrooms).astype(str) + " bedroom " + rng.choice(TYPES, rows) + " for sale"
+    else:
+        urls = "https://www.zoopla.co.uk/for-sale/details/" + pd.Series(ids) + "/?search_identifier=f7cd7930bec9ae4a"
+        titles = pd.Series(bedrooms).astype(str) + " bed " + rng.choice(TYPES, rows) + " for sale"
+
+    return pd.DataFrame({
+        "price": (rng.integers(375, 650, rows) * 1000).astype(float),
+        "type": titles,
+        "address": streets + ", " + towns + ", " + postcodes,
+        "url": urls,
+        "added_on": added_on.strftime("%Y-%m-%d"),
+        "search_datetime": (added_on + pd.Timedelta(hours=29)).strftime("%I:%M%p on %B %d, %Y"),
+        "postcode": postcodes,
+        "number_bedrooms": bedrooms.astype(float),
+        "listing_id": ids,
+    })
+
+
+def rightmove_card(row):
+    added_on = dt.datetime.strptime(row.added_on, "%Y-%m-%d").strftime("%d/%m/%Y")
+    return f"""<div class="l-searchResult is-list"><div class="propertyCard">
+<div class="propertyCard-details"><a class="propertyCard-link" href="/properties/{row.listing_id}#/?channel=RES_BUY">
+<h2 class="propertyCard-title">
+                {html.escape(row.type)}
+            </h2></a>
+<address class="propertyCard-address"><meta content="{html.escape(row.address)}"><span>{html.escape(row.address)}</span></address></div>
+<div class="propertyCard-price"><div class="propertyCard-priceValue">£{row.price:,.0f}</div></div>
+<div class="propertyCard-detailsFooter"><div class="propertyCard-branchSummary">
+<span class="propertyCard-branchSummary-addedOrReduced">Added on {added_on}</span></div></div></div></div>"""
+
+
+def zoopla_card(row):
+    added_on = dt.datetime.strptime(row.added_on, "%Y-%m-%d")
+    return f"""<div data-testid="search-result"><div><a data-testid="listing-details-link" href="/for-sale/details/{row.listing_id}/">
+<h2 data-testid="listing-title">{html.escape(row.type)}</h2></a>
+<div data-testid="listing-price"><p>£{row.price:,.0f}</p></div>
+<p data-testid="listing-description">{html.escape(row.address)}</p>
+<span data-testid="date-published">Listed on <!-- -->{added_on.day}th {added_on:%b %Y}</span></div></div>"""
+
+
+def pages(frame, portal: str):
+    size, card = (24, rightmove_card) if portal == "rightmove" else (25, zoopla_card)
+    header = f'<span class="searchHeader-resultCount">{len(frame):,}</span>' if portal == "rightmove" else \
+        f'<p data-testid="total-results">{len(frame)} results</p>'
+
+    for start in range(0, len(frame), size):
+        cards = "".join(card(row) for row in frame.iloc[start:start + size].itertuples(index=False))
+        yield f'<html><body><main data-testid="search-content">{header}{cards}</main></body></html>'.encode("utf-8")
+
+
+class SyntheticSession:
+
+    def __init__(self, rightmove, zoopla):
+        self.pages = {
+            "rightmove": list(pages(rightmove, "rightmove")),
+            "zoopla": list(pages(zoopla, "zoopla")),
+        }
+
+    def get(self, url, **kwargs):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        if "rightmove" in url:
+            page = int(query["index"]) // 24
+            content = self.pages["rightmove"][page]
+        else:
+            page = int(query["pn"]) - 1
+            content = self.pages["zoopla"][page]
+        return types.SimpleNamespace(url=url, status_code=200, headers={}, content=content)
+
+    def close(self):
+        pass
@@ -0,0 +1,129 @@
+import json
+import logging
+
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from geo import KM_PER_MILE, haversine
+from history import read_file
+
+
+class Subscriptions:
+    # Saved searches per recipient, e.g.
+    # [{"email": "a@example.com", "searches": [{"max_price": 550000, "min_bedrooms": 3, "near": "HP6", "radius_miles": 2}]}]
+    path = "subscriptions.json"
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def load(self):
+        content, _ = read_file(self.repo, self.path)
+        if content is None:
+            return None
+
+        subscribers = json.loads(content)
+        logging.info(f"Loaded {sum(len(subscriber['searches']) for subscriber in subscribers)} saved searches for {len(subscribers)} recipients")
+        return subscribers
+
+
+class AlertMatcher:
+    max_bedrooms = 10
+
+    def __init__(self, subscribers, districts=None, price_bucket: int = 25_000, max_price: int = 5_000_000):
+        self.price_bucket = price_bucket
+        self.max_bucket = max_price // price_bucket
+        self.searches = []
+
+        # Inverted indexes from a listing attribute to the searches accepting it; a listing is only ever compared with
+        # the searches found in all of them, so the cost follows the number of matches rather than listings x searches
+        self.by_postcode = defaultdict(set)
+        self.any_postcode = set()
+        self.by_bedrooms = defaultdict(set)
+        self.by_price = defaultdict(set)
+        self.by_price_edge = defaultdict(set)
+
+        for subscriber in subscribers:
+            for search in subscriber["searches"]:
+                self.add(subscriber["email"], search, districts)
+
+    def add(self, email, search, districts):
+        number = len(self.searches)
+        min_price, max_price = search.get("min_price"), search.get("max_price")
+        self.searches.append((email, min_price, max_price))
+
+        postcodes = {postcode.strip().upper() for postcode in search.get("postcodes", []) if postcode.strip()}
+        if "near" in search:
+            # A radius becomes the set of districts whose centroid lies inside it, so it shares the postcode lookup
+            centre = districts.centroid(search["near"])
+            if centre is None:
+                logging.warning(f"Unknown postcode district {search['near']} in a saved search for {email}")
+            else:
+                distance = haversine(*centre, districts.table["latitude"].to_numpy(), districts.table["longitude"].to_numpy())
+                postcodes |= set(districts.table.index[distance <= search.get("radius_miles", 1.0) * KM_PER_MILE])
+
+        if "postcodes" in search or "near" in search:
+            for postcode in postcodes:
+                self.by_postcode[postcode].add(number)
+        else:
+            self.any_postcode.add(number)
+
+        # Listings missing a bedroom count or a price (keyed -1) only reach searches that don't constrain it
+        min_bedrooms, max_bedrooms = search.get("min_bedrooms"), search.get("max_bedrooms")
+        if min_bedrooms is None and max_bedrooms is None:
+            self.by_bedrooms[-1].add(number)
+        for bedrooms in range(int(min_bedrooms or 0), int(min(max_bedrooms if max_bedrooms is not None else self.max_bedrooms, self.max_bedrooms)) + 1):
+            self.by_bedrooms[bedrooms].add(number)
+
+        if min_price is None and max_price is None:
+            self.by_price[-1].add(number)
+        # Buckets holding one of the bounds need the exact price checked, the ones in between match outright
+        low, high = self.bucket(min_price or 0), self.bucket(max_price if max_price is not None else np.inf)
+        for bucket in range(low, high + 1):
+            edge = (bucket == low and bool(min_price)) or (bucket == high and max_price is not None)
+            (self.by_price_edge if edge else self.by_price)[bucket].add(number)
+
+    def bucket(self, price):
+        return int(min(price, self.max_bucket * self.price_bucket) // self.price_bucket)
+
+    def candidates(self, postcode, bedrooms, bucket):
+        searches = self.by_bedrooms.get(bedrooms, set()).intersection(self.any_postcode | self.by_postcode.get(postcode, set()))
+        return searches & self.by_price.get(bucket, set()), searches & self.by_price_edge.get(bucket, set())
+
+    def match(self, listings):
+        # Recipient -> row positions in listings; rows sharing a (postcode, bedrooms, price bucket) are looked up once
+        matches = defaultdict(set)
+        if len(listings) == 0:
+            return matches
+
+        # Rows without a postcode (or frames without the column) can only reach searches that don't name one
+        postcode = listings["postcode"] if "postcode" in listings.columns else pd.Series(None, index=listings.index, dtype=object)
+        price = pd.to_numeric(listings["price"], errors="coerce").to_numpy(dtype=float)
+        keys = pd.DataFrame({
+            "postcode": postcode.astype(str).str.strip().str.upper().where(postcode.notnull(), "").to_numpy(),
+            "bedrooms": pd.to_numeric(listings["number_bedrooms"], errors="coerce").fillna(-1).clip(upper=self.max_bedrooms).astype(int).to_numpy(),
+            "bucket": np.where(np.isnan(price), -1, np.minimum(np.nan_to_num(price), self.max_bucket * self.price_bucket) // self.price_bucket).astype(int),
+        })
+
+        for (postcode, bedrooms, bucket), rows in keys.groupby(["postcode", "bedrooms", "bucket"]).indices.items():
+            inside, edge = self.candidates(postcode, bedrooms, bucket)
+            if inside:
+                positions = rows.tolist()
+                for number in inside:
+                    matches[self.searches[number][0]].update(positions)
+
+            for number in edge:
+                email, min_price, max_price = self.searches[number]
+                keep = (price[rows] >= (min_price or 0)) & (price[rows] <= (max_price if max_price is not None else np.inf))
+                matches[email].update(rows[keep].tolist())
+
+        return matches
+
+    def digests(self, listings, price_reductions):
+        listing_matches = self.match(listings)
+        reduction_matches = self.match(price_reductions) if price_reductions is not None else {}
+
+        for email in dict.fromkeys(email for email, _, _ in self.searches):
+            rows, reductions = sorted(listing_matches.get(email, ())), sorted(reduction_matches.get(email, ()))
+            yield email, listings.iloc[rows], price_reductions.iloc[reductions] if price_reductions is not None else None
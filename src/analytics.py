@@ -0,0 +1,189 @@
+import io
+import json
+import logging
+import math
+
+from collections import defaultdict
+
+import pandas as pd
+
+from columnar import SEARCH_DATETIME_FORMAT
+from history import read_file, write_file
+from parse import Parser
+
+
+class MarketRollups:
+    path = "history/rollups.json"
+    # The listings each month's groups are built from, one file per portal and month, e.g. history/rollups/zoopla/2026-10.csv
+    listings_root = "history/rollups"
+    dimensions = ["portal", "postcode", "bedrooms", "month"]
+    listing_columns = ["listing_id", "postcode", "bedrooms", "price"]
+
+    def __init__(self, repo, bucket_size: int = 5_000):
+        self.repo = repo
+        self.bucket_size = bucket_size
+        self.groups = None
+        self.partitions = None
+        self.listings = {}
+        self.listing_shas = {}
+        self.changed = set()
+        self.sha = None
+
+    def load(self):
+        if self.groups is not None:
+            return self.groups
+
+        content, self.sha = read_file(self.repo, self.path)
+        self.groups, self.partitions = {}, {}
+        if content is not None:
+            stored = json.loads(content)
+            if "partitions" not in stored:
+                # Older rollups counted history rows, or kept every listing inline; start again and reseed from the history
+                logging.warning(f"{self.path} predates per-month listing files, rebuilding it from the history")
+                return self.groups
+
+            self.bucket_size = stored["bucket_size"]
+            for portal, postcode, bedrooms, month, count, total, low, high, histogram in stored["groups"]:
+                self.groups[(portal, postcode, bedrooms, month)] = {
+                    "count": count,
+                    "sum": total,
+                    "min": low,
+                    "max": high,
+                    "histogram": {int(bucket): count for bucket, count in histogram.items()},
+                }
+            self.partitions = {portal: set(months) for portal, months in stored["partitions"].items()}
+
+        return self.groups
+
+    def has(self, portal: str):
+        self.load()
+        return portal in self.partitions
+
+    def listings_path(self, portal: str, month: str):
+        return f"{self.listings_root}/{portal}/{month}.csv"
+
+    def month_listings(self, portal: str, month: str):
+        key = (portal, month)
+        if key not in self.listings:
+            content, sha = None, None
+            if month in self.partitions.get(portal, ()):
+                content, sha = read_file(self.repo, self.listings_path(portal, month))
+
+            frame = pd.DataFrame(columns=self.listing_columns) if content is None else \
+                pd.read_csv(io.BytesIO(content), dtype={"listing_id": str, "postcode": str}, keep_default_na=False)
+            self.listings[key] = {
+                listing_id: (postcode, int(bedrooms), float(price))
+                for listing_id, postcode, bedrooms, price in frame[self.listing_columns].itertuples(index=False, name=None)
+            }
+            self.listing_shas[key] = sha
+
+        return self.listings[key]
+
+    def update(self, portal: str, rows):
+        # Each listing counts once per month at its latest price, however many history rows it has (price changes,
+        # overlapping searches); only the months the rows fall in are read, re-aggregated and rewritten
+        self.load()
+
+        frame = pd.DataFrame({
+            # Derived from the url every time: a listing_id column read back from CSV can come out as a float
+            "listing_id": Parser.listing_ids(rows["url"]).values,
+            "postcode": rows["postcode"].astype(str).str.upper().where(rows["postcode"].notnull(), "UNKNOWN").values,
+            "bedrooms": pd.to_numeric(rows["number_bedrooms"], errors="coerce").fillna(-1).astype(int).values,
+            "month": pd.to_datetime(rows["added_on"], errors="coerce").dt.strftime("%Y-%m").fillna("undated").values,
+            "price": pd.to_numeric(rows["price"], errors="coerce").values,
+            "seen": pd.to_datetime(rows["search_datetime"], format=SEARCH_DATETIME_FORMAT, errors="coerce").values
+            if "search_datetime" in rows.columns else pd.NaT,
+        })
+        # Price on application is stored as 0
+        frame = frame[(frame["price"] > 0) & frame["listing_id"].notnull()]
+        frame = frame.sort_values("seen", kind="stable", na_position="first").drop_duplicates(["listing_id", "month"], keep="last")
+
+        months = set()
+        for listing_id, postcode, bedrooms, month, price in frame[["listing_id", "postcode", "bedrooms", "month", "price"]].itertuples(index=False, name=None):
+            self.month_listings(portal, month)[listing_id] = (postcode, int(bedrooms), float(price))
+            months.add(month)
+
+        for month in months:
+            self.aggregate(portal, month)
+        self.partitions.setdefault(portal, set()).update(months)
+        self.changed.update((portal, month) for month in months)
+
+        logging.info(f"Rolled {len(frame)} {portal} listings into {len(months)} months of analytics groups")
+
+    def aggregate(self, portal: str, month: str):
+        for key in [key for key in self.groups if key[0] == portal and key[3] == month]:
+            del self.groups[key]
+
+        prices = defaultdict(list)
+        for postcode, bedrooms, price in self.listings[(portal, month)].values():
+            prices[(portal, postcode, bedrooms, month)].append(price)
+
+        for key, values in prices.items():
+            histogram = defaultdict(int)
+            for price in values:
+                histogram[int(price // self.bucket_size)] += 1
+            self.groups[key] = {"count": len(values), "sum": float(sum(values)), "min": min(values), "max": max(values), "histogram": dict(histogram)}
+
+    def save(self, commit_message):
+        self.load()
+        if not self.changed and self.sha is not None:
+            return
+
+        for portal, month in sorted(self.changed):
+            listings = pd.DataFrame([(listing_id, *value) for listing_id, value in sorted(self.listings[(portal, month)].items())], columns=self.listing_columns)
+            self.listing_shas[(portal, month)] = write_file(self.repo, self.listings_path(portal, month), listings.to_csv(index=False),
+                                                            self.listing_shas[(portal, month)], commit_message)
+        self.changed.clear()
+
+        # One row per group, in the order of dimensions then count, sum, min, max and histogram
+        groups = [
+            [*key, group["count"], group["sum"], group["min"], group["max"], {str(bucket): count for bucket, count in sorted(group["histogram"].items())}]
+            for key, group in sorted(self.groups.items())
+        ]
+        partitions = {portal: sorted(months) for portal, months in sorted(self.partitions.items())}
+        content = json.dumps({"bucket_size": self.bucket_size, "groups": groups, "partitions": partitions}, separators=(",", ":"))
+        self.sha = write_file(self.repo, self.path, content, self.sha, commit_message)
+
+    def query(self, group_by=None, **filters):
+        # Groups are merged on the fly, so any coarser view (e.g. all months for a postcode) costs O(groups)
+        group_by = [dimension for dimension in self.dimensions if dimension in (group_by or self.dimensions)]
+        merged = defaultdict(lambda: {"count": 0, "sum": 0.0, "min": math.inf, "max": -math.inf, "histogram": defaultdict(int)})
+
+        for key, group in self.load().items():
+            values = dict(zip(self.dimensions, key))
+            if any(values[name] != value for name, value in filters.items() if value is not None):
+                continue
+
+            target = merged[tuple(values[dimension] for dimension in group_by)]
+            target["count"] += group["count"]
+            target["sum"] += group["sum"]
+            target["min"] = min(target["min"], group["min"])
+            target["max"] = max(target["max"], group["max"])
+            for bucket, count in group["histogram"].items():
+                target["histogram"][bucket] += count
+
+        return [
+            {
+                **dict(zip(group_by, key)),
+                "count": group["count"],
+                "mean": round(group["sum"] / group["count"]),
+                "min": group["min"],
+                "max": group["max"],
+                "p25": self.quantile(group, 0.25),
+                "median": self.quantile(group, 0.5),
+                "p75": self.quantile(group, 0.75),
+            }
+            for key, group in sorted(merged.items())
+        ]
+
+    def quantile(self, group, q):
+        # Interpolate within the price bucket holding the q-th observation; accurate to within one bucket
+        histogram = group["histogram"]
+        target = q * group["count"]
+        seen = 0
+        for bucket in sorted(histogram):
+            if seen + histogram[bucket] >= target:
+                estimate = (bucket + (target - seen) / histogram[bucket]) * self.bucket_size
+                return round(min(max(estimate, group["min"]), group["max"]))
+            seen += histogram[bucket]
+        return None
@@ -0,0 +1,89 @@
+import io
+import sys
+
+import pandas as pd
+
+from parse import Parser
+
+SEARCH_DATETIME_FORMAT = "%I:%M%p on %B %d, %Y"
+FORMATS = ("feather", "parquet")
+
+
+def to_typed(frame):
+    typed = frame.copy()
+
+    if "listing_id" not in typed.columns:
+        typed["listing_id"] = Parser.listing_ids(typed["url"])
+
+    typed["price"] = pd.to_numeric(typed["price"], errors="coerce").round().astype("Int32")
+    typed["number_bedrooms"] = pd.to_numeric(typed["number_bedrooms"], errors="coerce").astype("UInt8")
+    typed["added_on"] = pd.to_datetime(typed["added_on"], dayfirst=True, errors="coerce")
+    typed["search_datetime"] = pd.to_datetime(typed["search_datetime"], format=SEARCH_DATETIME_FORMAT, errors="coerce")
+    typed["type"] = typed["type"].astype("category")
+    typed["postcode"] = typed["postcode"].astype("category")
+    for column in ["address", "url", "listing_id"]:
+        typed[column] = typed[column].astype("string")
+
+    return typed.reset_index(drop=True)
+
+
+def to_text(typed):
+    frame = typed.copy()
+
+    frame["added_on"] = pd.to_datetime(frame["added_on"]).dt.strftime("%Y-%m-%d")
+    frame["search_datetime"] = pd.to_datetime(frame["search_datetime"]).dt.strftime(SEARCH_DATETIME_FORMAT)
+    for column in ["type", "postcode"]:
+        frame[column] = frame[column].astype("object")
+
+    return frame
+
+
+def to_bytes(frame, file_format: str = "feather", compression: str = "zstd"):
+    buffer = io.BytesIO()
+    if file_format == "parquet":
+        to_typed(frame).to_parquet(buffer, index=False, compression=compression)
+    else:
+        to_typed(frame).to_feather(buffer, compression=compression)
+    return buffer.getvalue()
+
+
+def from_bytes(content: bytes, file_format: str = "feather"):
+    if file_format == "parquet":
+        return pd.read_parquet(io.BytesIO(content))
+    return pd.read_feather(io.BytesIO(content))
+
+
+def write(frame, path: str, compression: str = "uncompressed"):
+    # Uncompressed Feather can be memory-mapped and read without copying
+    if path.endswith(".parquet"):
+        to_typed(frame).to_parquet(path, index=False)
+    else:
+        to_typed(frame).to_feather(path, compression=compression)
+
+
+def read(path: str, memory_map: bool = True):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, memory_map=memory_map)
+
+    from pyarrow import feather
+    return feather.read_table(path, memory_map=memory_map).to_pandas()
+
+
+def import_csv(csv_path: str, path: str):
+    write(pd.read_csv(csv_path, encoding_errors='replace'), path)
+
+
+def export_csv(path: str, csv_path: str):
+    to_text(read(path)).to_csv(csv_path, index=False, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    # python src/columnar.py import rightmove-houses.csv rightmove-houses.feather
+    # python src/columnar.py export rightmove-houses.feather rightmove-houses.csv
+    command, source, destination = sys.argv[1:4]
+    if command == "import":
+        import_csv(source, destination)
+    elif command == "export":
+        export_csv(source, destination)
+    else:
+        raise ValueError(f"Unknown command: {command}. Expected 'import' or 'export'")
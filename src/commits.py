@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import logging
+import time
+import types
+
+from github import GithubException, InputGitTreeElement
+
+import metrics
+
+
+class BatchedRepository:
+    # Stands in for the GitHub repository during a run: reads go through, writes are staged and land as one commit
+
+    def __init__(self, repo, max_attempts: int = 3, retry_delay: float = 1.0):
+        self.repo = repo
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.staged = {}
+        self.bases = {}
+        self.messages = []
+
+    @staticmethod
+    def blob_sha(content: bytes):
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def get_contents(self, path: str):
+        if path in self.staged:
+            content = self.staged[path]
+            return types.SimpleNamespace(path=path, sha=self.blob_sha(content), decoded_content=content, size=len(content))
+
+        contents = self.repo.get_contents(path)
+        self.bases.setdefault(path, contents.sha)
+        return contents
+
+    def get_git_blob(self, sha: str):
+        for content in self.staged.values():
+            if self.blob_sha(content) == sha:
+                return types.SimpleNamespace(sha=sha, content=base64.b64encode(content).decode("ascii"), encoding="base64")
+
+        return self.repo.get_git_blob(sha)
+
+    def create_file(self, path: str, message: str, content, **kwargs):
+        if path in self.staged or self.bases.get(path) is not None:
+            raise GithubException(422, {"message": "\"sha\" wasn't supplied."}, None)
+
+        self.bases.setdefault(path, None)
+        return self.stage(path, message, content)
+
+    def update_file(self, path: str, message: str, content, sha: str, **kwargs):
+        current = self.blob_sha(self.staged[path]) if path in self.staged else self.bases.setdefault(path, sha)
+        if current != sha:
+            raise GithubException(409, {"message": f"{path} does not match {sha}"}, None)
+
+        return self.stage(path, message, content)
+
+    def stage(self, path: str, message: str, content):
+        if isinstance(content, str):
+            content = bytes(content, encoding='utf-8')
+
+        self.staged[path] = content
+        self.messages.append(message)
+        return {"content": types.SimpleNamespace(path=path, sha=self.blob_sha(content)), "commit": None}
+
+    def changed(self):
+        # Files rewritten with identical content are left out of the commit entirely
+        return {path: content for path, content in self.staged.items() if self.blob_sha(content) != self.bases.get(path)}
+
+    def commit(self, message: str):
+        changed = self.changed()
+        if not changed:
+            logging.info("Nothing changed, skipping the commit")
+            return None
+
+        if not hasattr(self.repo, "create_git_tree"):
+            # The replay directory stand-in has no Git Data API; write the files one by one instead
+            with metrics.timed(metrics.GITHUB_SECONDS, operation="commit"):
+                for path, content in changed.items():
+                    if self.bases.get(path) is None:
+                        self.repo.create_file(path=path, message=message, content=content)
+                    else:
+                        self.repo.update_file(path=path, message=message, content=content, sha=self.bases[path])
+            metrics.GITHUB_BYTES.inc(sum(len(content) for content in changed.values()), operation="commit")
+            return None
+
+        with metrics.timed(metrics.GITHUB_SECONDS, operation="commit"):
+            blobs = {path: self.repo.create_git_blob(base64.b64encode(content).decode("ascii"), "base64").sha for path, content in changed.items()}
+        metrics.GITHUB_BYTES.inc(sum(len(content) for content in changed.values()), operation="commit")
+
+        body = "\n".join(f"- {line}" for line in dict.fromkeys(self.messages))
+        ref = self.repo.get_git_ref(f"heads/{self.repo.default_branch}")
+
+        for attempt in range(1, self.max_attempts + 1):
+            with metrics.timed(metrics.GITHUB_SECONDS, operation="commit"):
+                head = self.repo.get_git_commit(ref.object.sha)
+                self.check_base(head, changed)
+
+                tree = self.repo.create_git_tree(
+                    [InputGitTreeElement(path, "100644", "blob", sha=sha) for path, sha in blobs.items()], base_tree=head.tree)
+                commit = self.repo.create_git_commit(f"{message}\n\n{body}", tree, [head])
+
+                try:
+                    ref.edit(commit.sha, force=False)
+                except GithubException as error:
+                    # Someone else moved the branch since we read it; rebase onto their commit and try again
+                    if attempt == self.max_attempts or error.status not in (409, 422):
+                        raise
+                    logging.warning(f"Branch moved while committing, rebasing (attempt {attempt} of {self.max_attempts}): {error.data}")
+                    time.sleep(self.retry_delay * attempt)
+                    ref = self.repo.get_git_ref(f"heads/{self.repo.default_branch}")
+                    continue
+
+            logging.info(f"Committed {len(changed)} files in {commit.sha[:7]}: {message}")
+            self.bases.update({path: blobs[path] for path in changed})
+            self.staged.clear()
+            self.messages.clear()
+            return commit.sha
+
+    def check_base(self, head, changed):
+        # Committing onto head (or rebasing onto it) is only safe while it still holds our files as we read them
+        current = {element.path: element.sha for element in self.repo.get_git_tree(head.tree.sha, recursive=True).tree}
+        conflicts = [path for path in changed if current.get(path) != self.bases.get(path)]
+        if conflicts:
+            raise GithubException(409, {"message": f"Conflicting changes to {', '.join(conflicts)}"}, None)
@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+import urllib.parse
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+class HostLimit:
+
+    def __init__(self, concurrency: int = 2, requests_per_second: float = 1.0):
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.interval = 1 / requests_per_second if requests_per_second else 0.0
+        self.lock = threading.Lock()
+        self.next_request_at = 0.0
+
+    def __enter__(self):
+        self.slots.acquire()
+
+        # Reserve the next slot in the requests-per-second budget, then wait for it outside the lock
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_request_at)
+            self.next_request_at = start_at + self.interval
+
+        if start_at > now:
+            time.sleep(start_at - now)
+        return self
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+
+class LimitedSession:
+
+    def __init__(self, session, limit: HostLimit, host: str):
+        self.session = session
+        self.limit = limit
+        self.host = host
+
+    def get(self, url, **kwargs):
+        queued = time.perf_counter()
+        with self.limit:
+            # Waiting for the host's connection slots and rate budget is reported apart from the request itself
+            metrics.QUEUE_SECONDS.observe(time.perf_counter() - queued, host=self.host)
+            with metrics.timed(metrics.REQUEST_SECONDS, host=self.host):
+                return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class ParsePool:
+
+    def __init__(self, workers: int, max_pending: int = None):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.pending = threading.BoundedSemaphore(max_pending or workers * 2)
+
+        # Start the workers now, before the fetch threads exist: forking while another thread holds a lock can hang the child
+        self.executor.submit(time.perf_counter).result()
+
+    def submit(self, search, page: bytes) -> Future:
+        # Fetchers block here while max_pending pages wait to be parsed, so unparsed HTML can't pile up in memory
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(parse_page, type(search), page)
+        except Exception:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda _: self.pending.release())
+        return future
+
+    @staticmethod
+    def records(search, future: Future):
+        elapsed, fields, rows = future.result()
+        metrics.PARSE_SECONDS.observe(elapsed, portal=search.portal)
+        metrics.ROWS_EXTRACTED.inc(len(rows), portal=search.portal)
+        return [dict(zip(fields, row)) for row in rows]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def parse_page(portal, page: bytes):
+    # Runs in a worker process; rows go back as tuples, which pickle far smaller than one dict per listing
+    started = time.perf_counter()
+    fields = list(portal.extractor.fields)
+    rows = [tuple(record[field] for field in fields) for record in portal.extractor.records(portal.extractor.parse(page))]
+    return time.perf_counter() - started, fields, rows
+
+
+class CrawlScheduler:
+
+    def __init__(self, max_workers: int = 8,
+                 host_limits: dict[str, HostLimit] = None,
+                 default_limit: tuple[int, float] = (2, 1.0),
+                 timeout: float = 30,
+                 session_factory=None,
+                 parse_pool: ParsePool = None):
+        self.max_workers = max_workers
+        self.host_limits = dict(host_limits or {})
+        self.default_limit = default_limit
+        self.timeout = timeout
+        self.session_factory = session_factory or self.create_session
+        self.parse_pool = parse_pool
+        self.sessions = {}
+        # Reentrant: sessions are created under it, and create_session looks up the host's limit
+        self.lock = threading.RLock()
+
+    def get(self, url, headers=None):
+        host = urllib.parse.urlsplit(url).netloc
+        return self._session(host).get(url, headers=headers, timeout=self.timeout)
+
+    def crawl(self, searches: list) -> list:
+        for search in searches:
+            search.session = self
+
+        started = time.monotonic()
+        page_futures = {}
+        walks = {}
+        finished = {}
+
+        def record_finish(future):
+            finished[future] = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            first_pages = {executor.submit(search.first_page): search for search in searches}
+            for future in first_pages:
+                future.add_done_callback(record_finish)
+
+            # Fan out the remaining pages of each search as soon as its page count is known
+            for future in as_completed(first_pages):
+                search = first_pages[future]
+                page_futures[search] = [future]
+
+                # A failed search is reported when its listings are consumed, without stopping the others
+                try:
+                    search.current_page = future.result()
+                    indexes = search.page_indexes()
+                except Exception as error:
+                    logging.warning(f"Crawl of {search.location_identifier} failed: {error!r}")
+                    if future.exception() is None:
+                        page_futures[search].append(failed_future(error))
+                    continue
+
+                # Incremental searches walk their pages in order instead, stopping at the watermark
+                if search.watermark is not None:
+                    walk = executor.submit(lambda s=search: list(s.newer_pages(s.current_page)))
+                    walk.add_done_callback(record_finish)
+                    walks[search] = walk
+                    continue
+
+                for index in indexes:
+                    page_future = executor.submit(self._fetch, search, index)
+                    page_future.add_done_callback(record_finish)
+                    page_futures[search].append(page_future)
+
+        logging.info(f"Crawled {len(searches)} searches in {time.monotonic() - started:.1f}s")
+
+        # A region is done when the last of its pages has arrived
+        for search, futures in page_futures.items():
+            region_finished = max(finished.get(f, started) for f in futures + [walks.get(search)])
+            metrics.REGION_SECONDS.observe(region_finished - started, portal=search.portal, region=search.location_identifier)
+
+        return [self._listings(search, page_futures[search], walks.get(search)) for search in searches]
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+
+    def _fetch(self, search, index):
+        page = search._request(index)
+        if self.parse_pool is None:
+            return page
+        return self.parse_pool.submit(search, page)
+
+    def _listings(self, search, futures, walk=None):
+        # First pages and incremental walks are already parsed trees; the bulk of a full crawl comes back from the parse pool
+        for future in futures:
+            page = future.result()
+            if isinstance(page, Future):
+                yield from self.parse_pool.records(search, page)
+            else:
+                yield from search.process_page(page)
+
+        if walk is not None:
+            for page in walk.result():
+                yield from search.process_page(page)
+
+    def _limit(self, host) -> HostLimit:
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = HostLimit(*self.default_limit)
+            return self.host_limits[host]
+
+    def create_session(self, host):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        # The host's limit sits innermost, so responses served by a wrapping session (the response cache) never wait for it
+        return LimitedSession(session, self._limit(host), host)
+
+    def _session(self, host):
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = self.session_factory(host)
+            return self.sessions[host]
+
+
+def failed_future(error) -> Future:
+    future = Future()
+    future.set_exception(error)
+    return future
@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+ENVIRONMENT = os.environ.get("ENVIRONMENT", "ENVIRONMENT environment variable is not set.")
+SECRET_REFRESH_SECONDS = float(os.environ.get("SECRET_REFRESH_SECONDS", 60 * 60))
+
+# Secret Manager id -> environment variable used outside gcloud
+SECRETS = {
+    "github-access-token": "GITHUB_ACCESS_TOKEN",
+    "sendgrid-api-key": "SENDGRID_API_KEY",
+    "from-email": "FROM_EMAIL",
+    "to-email": "TO_EMAIL",
+}
+
+
+class Lazy:
+
+    def __init__(self, factory, refresh_interval: float = None):
+        self.factory = factory
+        self.refresh_interval = refresh_interval
+        self.value = None
+        self.created_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.created_at is None or self.expired():
+                self.value = self.factory()
+                self.created_at = time.monotonic()
+            return self.value
+
+    def expired(self):
+        return self.refresh_interval is not None and time.monotonic() - self.created_at > self.refresh_interval
+
+
+class SecretStore:
+
+    def __init__(self, names, use_secret_manager: bool, refresh_interval: float = 60 * 60):
+        self.names = names
+        self.use_secret_manager = use_secret_manager
+        self.values = Lazy(self.fetch, refresh_interval)
+        self.client = Lazy(self.create_client)
+
+    def get(self, name: str):
+        return self.values.get()[name]
+
+    def fetch(self):
+        if not self.use_secret_manager:
+            return {name: os.environ.get(variable, f"{variable} environment variable is not set.") for name, variable in self.names.items()}
+
+        # Every secret is fetched at once, in parallel, so a cold start pays for one round trip rather than one per secret
+        client, project_id = self.client.get()
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.names)) as executor:
+                values = executor.map(lambda name: self.access(client, project_id, name), self.names)
+                return dict(zip(self.names, values))
+        except Exception as error:
+            if self.values.value is None:
+                raise
+            logging.warning(f"Failed to refresh secrets, keeping the cached values: {error!r}")
+            return self.values.value
+
+    @staticmethod
+    def create_client():
+        import google.auth
+        from google.cloud import secretmanager
+
+        _, project_id = google.auth.default()
+        return secretmanager.SecretManagerServiceClient(), project_id
+
+    @staticmethod
+    def access(client, project_id, name):
+        secret = client.access_secret_version(request={"name": f"projects/{project_id}/secrets/{name}/versions/latest"})
+        return secret.payload.data.decode("utf-8")
+
+
+def setup_cloud_logging():
+    if ENVIRONMENT == 'gcloud':
+        import google.cloud.logging
+
+        client = google.cloud.logging.Client()
+        client.setup_logging()
+        return client
+
+
+secrets = SecretStore(SECRETS, ENVIRONMENT == 'gcloud', SECRET_REFRESH_SECONDS)
+cloud_logging = Lazy(setup_cloud_logging)
@@ -0,0 +1,148 @@
+import html
+
+import numpy as np
+import pandas as pd
+
+
+class DigestRenderer:
+    table_start = "<table border='1' style='text-align: left; width:100%'>"
+    table_end = "</table>"
+    listing_headings = ["Index", "Address", "Price", "No. of Bedrooms", "Link"]
+    reduction_headings = ["Index", "Address", "Previous Price", "Price", "Change", "No. of Bedrooms", "Link"]
+
+    def __init__(self, group_by: str = "postcode", max_bytes: int = 500_000):
+        self.group_by = group_by
+        self.max_bytes = max_bytes
+
+    def render(self, listings, price_reductions=None):
+        # Returns one HTML body per message, each kept under max_bytes where a single row allows it
+        listings = self.sort(listings, "price")
+        if price_reductions is None or len(price_reductions) == 0:
+            return self.pack([(None, self.listing_headings, self.groups(self.listing_rows(listings), listings))])
+
+        price_reductions = self.sort(price_reductions, "price_change" if "price_change" in price_reductions.columns else "price")
+        return self.pack([
+            ("New properties", self.listing_headings, self.groups(self.listing_rows(listings), listings)),
+            ("Price reductions", self.reduction_headings, self.groups(self.reduction_rows(price_reductions), price_reductions)),
+        ])
+
+    def sort(self, frame, column):
+        keys = [column]
+        if self.grouped(frame):
+            keys = ["postcode", column]
+        return frame.sort_values(keys, kind="stable", na_position="last").reset_index(drop=True)
+
+    def grouped(self, frame):
+        return self.group_by == "postcode" and "postcode" in frame.columns
+
+    def groups(self, rows, frame):
+        if not self.grouped(frame):
+            return [(None, rows.tolist())]
+
+        keys = frame["postcode"].astype(str).str.upper().where(frame["postcode"].notnull(), "Other")
+        return [(key, group.tolist()) for key, group in rows.groupby(keys, sort=False)]
+
+    def pack(self, sections):
+        messages, parts, size = [], [], 0
+        open_table = None
+
+        for title, headings, groups in sections:
+            header = "<tr>" + "".join(f"<th>{heading}</th>" for heading in headings) + "</tr>"
+
+            for group, rows in groups:
+                for row in rows:
+                    # The limit is on the encoded payload; "£" and non-ASCII addresses take more than one byte
+                    row_bytes = len(row.encode("utf-8"))
+                    opening = self.opening(open_table, title, group, header)
+                    if parts and size + self.size(opening) + row_bytes + len(self.table_end) > self.max_bytes:
+                        parts.append(self.table_end)
+                        messages.append("".join(parts))
+                        parts, size, open_table = [], 0, None
+                        opening = self.opening(open_table, title, group, header)
+
+                    # Repeat the section and group headings whenever a table starts, including in a continuation message
+                    parts.extend(opening)
+                    size += self.size(opening)
+                    open_table = (title, group)
+
+                    parts.append(row)
+                    size += row_bytes
+
+        if parts:
+            parts.append(self.table_end)
+            messages.append("".join(parts))
+
+        return messages
+
+    def opening(self, open_table, title, group, header):
+        if open_table == (title, group):
+            return []
+
+        opening = [self.table_end] if open_table is not None else []
+        if title is not None and (open_table is None or open_table[0] != title):
+            opening.append(f"<h3>{title}</h3>")
+        if group is not None:
+            opening.append(f"<h4>{html.escape(group)}</h4>")
+        opening.append(self.table_start + header)
+        return opening
+
+    @staticmethod
+    def size(parts):
+        return sum(len(part.encode("utf-8")) for part in parts)
+
+    def listing_rows(self, frame):
+        return self.rows(frame, [
+            self.escape(frame["address"]),
+            self.money(frame["price"]),
+            self.count(frame["number_bedrooms"]),
+            self.links(frame),
+        ])
+
+    def reduction_rows(self, frame):
+        return self.rows(frame, [
+            self.escape(frame["address"]),
+            self.money(frame["previous_price"]),
+            self.money(frame["price"]),
+            "-" + self.money(frame["previous_price"] - frame["price"]),
+            self.count(frame["number_bedrooms"]),
+            self.links(frame),
+        ])
+
+    @staticmethod
+    def rows(frame, cells):
+        # Rows are numbered in the order they appear in the digest, across every group
+        numbers = pd.Series(np.arange(1, len(frame) + 1), index=frame.index).astype(str)
+        row = "<tr><td>" + numbers
+        for cell in cells:
+            row = row + "</td><td>" + cell
+        return row + "</td></tr>"
+
+    @staticmethod
+    def escape(column):
+        return column.astype(str).map(html.escape)
+
+    @staticmethod
+    def money(column):
+        return "£" + pd.to_numeric(column, errors="coerce").map("{:,.0f}".format, na_action="ignore").fillna("")
+
+    @staticmethod
+    def count(column):
+        return pd.to_numeric(column, errors="coerce").map("{:.0f}".format, na_action="ignore").fillna("")
+
+    @classmethod
+    def links(cls, frame):
+        columns = [column for column in ("rightmove_url", "zoopla_url") if column in frame.columns]
+        if not columns:
+            return cls.link(frame["url"]).fillna("")
+
+        links = [cls.link(frame[column]) for column in columns]
+        combined = links[0].fillna("")
+        for link in links[1:]:
+            combined = combined + np.where(combined.ne("") & link.notnull(), "<br>", "") + link.fillna("")
+        return combined.where(combined.ne(""), cls.link(frame["url"]).fillna(""))
+
+    @staticmethod
+    def link(urls):
+        urls = urls.where(urls.map(lambda url: isinstance(url, str)))
+        escaped = urls.map(html.escape, na_action="ignore").astype(object)
+        return "<a href='" + escaped + "'>" + escaped + "</a>"
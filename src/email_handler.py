@@ -1,3 +1,4 @@
+import datetime as dt
 import logging
 import os
 
@@ -6,76 +7,56 @@ from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail, Email, To
 from python_http_client.exceptions import HTTPError
 
-load_dotenv()
-ENVIRONMENT = os.environ.get("ENVIRONMENT", "ENVIRONMENT environment variable is not set.")
+import metrics
+from credentials import Lazy, SECRET_REFRESH_SECONDS, secrets
+from digest import DigestRenderer
 
-if ENVIRONMENT == 'gcloud':
-    import google.auth
-    from google.cloud import secretmanager
+load_dotenv()
+EMAIL_GROUP_BY = os.environ.get("EMAIL_GROUP_BY", "postcode")
+EMAIL_MAX_BYTES = int(os.environ.get("EMAIL_MAX_BYTES", 500_000))
 
-    secrets = secretmanager.SecretManagerServiceClient()
-    _, project_id = google.auth.default()
-    SENDGRID_API_KEY = secrets.access_secret_version(request={"name": f"projects/{project_id}/secrets/sendgrid-api-key/versions/latest"}).payload.data.decode("utf-8")
-    FROM_EMAIL = secrets.access_secret_version(request={"name": f"projects/{project_id}/secrets/from-email/versions/latest"}).payload.data.decode("utf-8")
-    TO_EMAIL = secrets.access_secret_version(request={"name": f"projects/{project_id}/secrets/to-email/versions/latest"}).payload.data.decode("utf-8")
-else:
-    SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY", "SENDGRID_API_KEY environment variable is not set.")
-    FROM_EMAIL = os.environ.get("FROM_EMAIL", "FROM_EMAIL environment variable is not set.")
-    TO_EMAIL = os.environ.get("TO_EMAIL", "TO_EMAIL environment variable is not set.")
+sendgrid_client = Lazy(lambda: SendGridAPIClient(secrets.get("sendgrid-api-key")), SECRET_REFRESH_SECONDS)
 
 
 class EmailSender:
 
-    def __init__(self, dataframe):
+    def __init__(self, dataframe, price_reductions=None, api_client=None, recipients=None):
         self.dataframe = dataframe
-        self.api_client = self.authenticate()
+        self.recipients = recipients
+        self.price_reductions = price_reductions if price_reductions is not None else dataframe.iloc[0:0]
+        self.api_client = api_client or self.authenticate()
         self.send_email()
 
+    @metrics.timed(metrics.EMAIL_SECONDS)
     def send_email(self):
-        logging.info(f"Processing email with {len(self.dataframe)} items")
+        logging.info(f"Processing email with {len(self.dataframe)} items and {len(self.price_reductions)} price reductions")
 
-        if len(self.dataframe) > 0:
+        if len(self.dataframe) > 0 or len(self.price_reductions) > 0:
             try:
-                date = self.dataframe.iloc[0]["added_on"]
-                message = self.generate_mail(f"Properties for {date}", self.create_email_text())
-                response = self.api_client.send(message)
+                date = self.dataframe.iloc[0]["added_on"] if len(self.dataframe) > 0 else dt.date.today().isoformat()
+                messages = self.create_email_text()
+
+                # Very large digests go out as several numbered messages to stay under SendGrid's payload limit
+                for number, message_text in enumerate(messages, start=1):
+                    subject = f"Properties for {date}" if len(messages) == 1 else f"Properties for {date} ({number}/{len(messages)})"
+                    response = self.api_client.send(self.generate_mail(subject, message_text))
+                    metrics.EMAILS_SENT.inc(status=response.status_code)
+
                 return f"email.status_code={response.status_code}"
 
             except HTTPError as error:
+                metrics.EMAILS_SENT.inc(status="error")
                 logging.error(f"HTTPError trying to send email: {error}")
 
     def create_email_text(self):
-        email_message_start = "<table border='1' style='text-align: left; width:100%'>" \
-                              "<tr>" \
-                              "<th>Index</th>" \
-                              "<th>Address</th>" \
-                              "<th>Price</th>" \
-                              "<th>No. of Bedrooms</th>" \
-                              "<th>Link</th>" \
-                              "</tr>"
-        content = ""
-        count = 1
-
-        for index, row in self.dataframe.iterrows():
-            content += "<tr>" \
-                       f"<td>{count}</td>" \
-                       f"<td>{row['address']}</td>" \
-                       f"<td>£{row['price']}</td>" \
-                       f"<td>{row['number_bedrooms']}</td>" \
-                       f"<td><a href='{row['url']}'>{row['url']}</a></td>" \
-                       "</tr>"
-            count += 1
-
-        email_message_end = "</table>"
-
-        return email_message_start + content + email_message_end
+        return DigestRenderer(group_by=EMAIL_GROUP_BY, max_bytes=EMAIL_MAX_BYTES).render(self.dataframe, self.price_reductions)
 
     def generate_mail(self, subject, message_text):
         logging.info(f"Creating email with data items of length: {len(self.dataframe)}")
 
         return Mail(
-            to_emails=self.generate_recipients(),
-            from_email=Email(FROM_EMAIL, "Christopher Philp"),
+            to_emails=[To(email) for email in self.recipients] if self.recipients else self.generate_recipients(),
+            from_email=Email(secrets.get("from-email"), "Christopher Philp"),
             subject=subject,
             html_content=message_text,
         )
@@ -83,11 +64,11 @@ class EmailSender:
     @staticmethod
     def generate_recipients():
         recipients = []
-        for email in str(TO_EMAIL).split(","):
+        for email in str(secrets.get("to-email")).split(","):
             recipients.append(To(email))
         return recipients
 
     @staticmethod
     def authenticate():
         logging.info(f"Authenticating user")
-        return SendGridAPIClient(SENDGRID_API_KEY)
+        return sendgrid_client.get()
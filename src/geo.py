@@ -0,0 +1,108 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_MILE = 1.609344
+
+
+class PostcodeDistricts:
+    # Approximate district centroids for the searched areas, shipped with the app so lookups never touch the network
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "postcode_districts.csv")
+
+    def __init__(self, path: str = None):
+        self.table = pd.read_csv(path or self.path).set_index("district")
+
+    def locate(self, postcodes):
+        districts = postcodes.astype(str).str.strip().str.upper()
+        located = self.table.reindex(districts)[["latitude", "longitude"]]
+        return located.set_axis(postcodes.index)
+
+    def centroid(self, district: str):
+        district = district.strip().upper()
+        if district not in self.table.index:
+            return None
+        return tuple(self.table.loc[district, ["latitude", "longitude"]])
+
+
+class SpatialIndex:
+    columns = ["portal", "address", "price", "number_bedrooms", "postcode", "added_on", "url"]
+
+    def __init__(self, listings, districts: PostcodeDistricts, cell_km: float = 1.0):
+        self.districts = districts
+        located = districts.locate(listings["postcode"])
+        known = located["latitude"].notnull().values
+        # Price on application is stored as 0 and would sort ahead of every priced listing, so those are left out
+        keep = known & pd.to_numeric(listings["price"], errors="coerce").gt(0).values
+
+        self.listings = listings.loc[keep, [column for column in self.columns if column in listings.columns]].reset_index(drop=True)
+        self.latitude = located["latitude"].to_numpy()[keep]
+        self.longitude = located["longitude"].to_numpy()[keep]
+        self.price = pd.to_numeric(self.listings["price"], errors="coerce").to_numpy(dtype=float)
+        self.bedrooms = pd.to_numeric(self.listings["number_bedrooms"], errors="coerce").to_numpy(dtype=float)
+        self.unlocated = int((~known).sum())
+
+        # Equirectangular projection around the data's own latitude is accurate to metres at this scale
+        self.cell_km = cell_km
+        self.cos_latitude = math.cos(math.radians(np.mean(self.latitude) if len(self.latitude) else 51.5))
+        cells = self.cells(self.latitude, self.longitude)
+        self.grid = pd.DataFrame({"x": cells[0], "y": cells[1]}).groupby(["x", "y"]).indices
+
+    def project(self, latitude, longitude):
+        return (np.asarray(longitude) * self.cos_latitude * EARTH_RADIUS_KM * math.pi / 180,
+                np.asarray(latitude) * EARTH_RADIUS_KM * math.pi / 180)
+
+    def cells(self, latitude, longitude):
+        x, y = self.project(latitude, longitude)
+        return np.floor(x / self.cell_km).astype(int), np.floor(y / self.cell_km).astype(int)
+
+    def candidates(self, south, west, north, east):
+        # Only the grid cells overlapping the box are visited, so a query costs O(cells + matches), not O(history)
+        (x0, x1), (y0, y1) = self.cells([south, north], [west, east])
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.grid):
+            cells = [rows for (x, y), rows in self.grid.items() if x0 <= x <= x1 and y0 <= y <= y1]
+        else:
+            cells = [self.grid[(x, y)] for x in range(x0, x1 + 1) for y in range(y0, y1 + 1) if (x, y) in self.grid]
+        return np.concatenate(cells) if cells else np.array([], dtype=int)
+
+    def radius(self, latitude: float, longitude: float, radius_km: float, **filters):
+        delta_latitude = math.degrees(radius_km / EARTH_RADIUS_KM)
+        delta_longitude = delta_latitude / self.cos_latitude
+        rows = self.candidates(latitude - delta_latitude, longitude - delta_longitude,
+                               latitude + delta_latitude, longitude + delta_longitude)
+
+        distance = haversine(latitude, longitude, self.latitude[rows], self.longitude[rows])
+        keep = (distance <= radius_km) & self.matches(rows, **filters)
+
+        results = self.results(rows[keep])
+        results["distance_miles"] = np.round(distance[keep] / KM_PER_MILE, 2)
+        return results.sort_values(["distance_miles", "price"], kind="stable")
+
+    def bounding_box(self, south: float, west: float, north: float, east: float, **filters):
+        rows = self.candidates(south, west, north, east)
+        inside = (self.latitude[rows] >= south) & (self.latitude[rows] <= north) & \
+                 (self.longitude[rows] >= west) & (self.longitude[rows] <= east)
+
+        return self.results(rows[inside & self.matches(rows, **filters)]).sort_values("price", kind="stable")
+
+    def matches(self, rows, min_price=None, max_price=None, min_bedrooms=None, max_bedrooms=None):
+        keep = np.ones(len(rows), dtype=bool)
+        for values, bound, compare in ((self.price, min_price, np.greater_equal), (self.price, max_price, np.less_equal),
+                                       (self.bedrooms, min_bedrooms, np.greater_equal), (self.bedrooms, max_bedrooms, np.less_equal)):
+            if bound is not None:
+                keep &= compare(values[rows], bound)
+        return keep
+
+    def results(self, rows):
+        results = self.listings.iloc[rows].reset_index(drop=True)
+        results["latitude"] = self.latitude[rows]
+        results["longitude"] = self.longitude[rows]
+        return results
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    latitude, longitude, latitudes, longitudes = map(np.radians, (latitude, longitude, latitudes, longitudes))
+    a = np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
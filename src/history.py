@@ -0,0 +1,338 @@
+import base64
+import datetime as dt
+import io
+import json
+import logging
+import zlib
+
+import pandas as pd
+
+import columnar
+import metrics
+
+from github import UnknownObjectException
+from parse import Parser
+
+GITHUB_CONTENTS_LIMIT = 1024 * 1024
+
+
+def merge_history(history, new_properties):
+    csv = pd.concat([history, new_properties])
+
+    csv['added_on'] = pd.to_datetime(csv['added_on'], dayfirst=True)
+    csv = csv.sort_values("added_on", ascending=False)
+    csv["added_on"] = csv["added_on"].astype('str')
+
+    # Older rows predate the `listing_id` column, so derive it rather than let NaN defeat the dedupe
+    csv["listing_id"] = Parser.listing_ids(csv["url"])
+
+    return csv[~dedupe_keys(csv).duplicated().values]
+
+
+def new_rows(history, new_properties):
+    # Scraped rows that merge_history will actually add, counted once even when overlapping searches both found them
+    stored = dedupe_keys(history) if len(history) else pd.Series(dtype="uint64")
+    scraped = dedupe_keys(new_properties)
+    return new_properties[(~scraped.isin(stored) & ~scraped.duplicated()).values]
+
+
+def dedupe_keys(rows):
+    # A row repeats another when the listing and its price, type and address match; the url differs between the searches
+    # that found it (Zoopla adds the search to it), so it only stands in for listings without an ID
+    values = pd.DataFrame({
+        "listing_id": Parser.listing_ids(rows["url"]).fillna(rows["url"].astype(str)),
+        "price": pd.to_numeric(rows["price"], errors="coerce").astype("float64"),
+        "type": rows["type"].astype(str),
+        "address": rows["address"].astype(str),
+    })
+    return pd.util.hash_pandas_object(values, index=False)
+
+
+class ListingIndex:
+    NEW = "new"
+    UNCHANGED = "unchanged"
+    UPDATED = "updated"
+
+    columns = ["portal", "listing_id", "fingerprint", "partition"]
+
+    def __init__(self, portal: str, shards: int = 1):
+        self.portal = portal
+        self.shards = shards
+        self.entries = {}
+        self.changed = set()
+
+    def shard(self, listing_id) -> int:
+        return zlib.crc32(str(listing_id).encode('utf-8')) % self.shards
+
+    @staticmethod
+    def fingerprints(rows):
+        values = pd.DataFrame({
+            "price": pd.to_numeric(rows["price"], errors="coerce").astype("float64"),
+            "type": rows["type"].astype(str),
+            "address": rows["address"].astype(str),
+        })
+        return pd.util.hash_pandas_object(values, index=False)
+
+    def classify(self, rows):
+        status = []
+        for listing_id, fingerprint in zip(rows["listing_id"], self.fingerprints(rows)):
+            entry = self.entries.get((self.portal, listing_id))
+            if entry is None:
+                status.append(self.NEW)
+            elif entry[0] == fingerprint:
+                status.append(self.UNCHANGED)
+            else:
+                status.append(self.UPDATED)
+        return pd.Series(status, index=rows.index, dtype="object")
+
+    def update(self, rows, partitions):
+        for listing_id, fingerprint, partition in zip(rows["listing_id"], self.fingerprints(rows), partitions):
+            if isinstance(listing_id, str):
+                self.entries[(self.portal, listing_id)] = (fingerprint, partition)
+                self.changed.add(self.shard(listing_id))
+
+    def loads(self, content: str):
+        index = pd.read_csv(io.StringIO(content), dtype={"portal": str, "listing_id": str, "fingerprint": "uint64", "partition": str})
+        self.entries.update({
+            (portal, listing_id): (fingerprint, partition)
+            for portal, listing_id, fingerprint, partition in index[self.columns].itertuples(index=False)
+        })
+        return self
+
+    def dumps(self, shard: int = None):
+        rows = [(portal, listing_id, fingerprint, partition) for (portal, listing_id), (fingerprint, partition) in self.entries.items()
+                if shard is None or self.shard(listing_id) == shard]
+        return pd.DataFrame(rows, columns=self.columns).to_csv(index=False)
+
+
+class PartitionedHistory:
+    # The listing index is split by a hash of the listing ID, so a run only reads and rewrites the shards its listings fall in
+    index_shards = 64
+
+    def __init__(self, repo, portal: str, legacy_path: str = None, file_format: str = "csv"):
+        if file_format != "csv" and file_format not in columnar.FORMATS:
+            raise ValueError(f"Unsupported history format: {file_format}")
+
+        self.repo = repo
+        self.portal = portal
+        self.file_format = file_format
+        self.root = f"history/{portal}"
+        self.legacy_path = legacy_path
+        self.manifest_path = f"{self.root}/manifest.json"
+        self.manifest = None
+        self.manifest_sha = None
+        self.legacy_index_path = f"{self.root}/index.csv"
+        self.index = None
+        self.index_shas = {}
+        self.appended = None
+
+    def index_path(self, shard: int):
+        return f"{self.root}/index/{shard:02d}.csv"
+
+    def partition_path(self, partition: str):
+        return f"{self.root}/{partition}.{self.file_format}"
+
+    def serialize(self, frame):
+        if self.file_format == "csv":
+            return frame.to_csv(index=False, encoding='utf-8')
+        return columnar.to_bytes(frame, self.file_format)
+
+    def deserialize(self, content: bytes):
+        if self.file_format == "csv":
+            return pd.read_csv(io.BytesIO(content), encoding_errors='replace')
+        return columnar.to_text(columnar.from_bytes(content, self.file_format))
+
+    @staticmethod
+    def partition_keys(added_on):
+        return pd.to_datetime(added_on, dayfirst=True).dt.strftime("%Y-%m").fillna("undated")
+
+    def append(self, new_properties, commit_message, yesterday):
+        self.load_manifest()
+        # Overlapping searches return the same listing more than once, e.g. Zoopla under a different search in the url;
+        # only its first row is kept, so a listing new tonight is classified and appended once
+        repeated = new_properties["listing_id"].notnull() & new_properties["listing_id"].duplicated()
+        new_properties = new_properties[~repeated.values]
+        self.load_index(new_properties["listing_id"])
+
+        # Listings whose (portal, id) is already indexed with the same content never touch a partition
+        status = self.index.classify(new_properties)
+        counts = status.value_counts()
+        logging.info(f"{self.portal}: {counts.get(ListingIndex.NEW, 0)} new, {counts.get(ListingIndex.UPDATED, 0)} updated, "
+                     f"{counts.get(ListingIndex.UNCHANGED, 0)} unchanged listings")
+        for result, count in counts.items():
+            metrics.DEDUP_ROWS.inc(int(count), portal=self.portal, result=result)
+        new_properties = new_properties[(status != ListingIndex.UNCHANGED).values]
+        self.appended = new_properties
+
+        keys = self.partition_keys(new_properties["added_on"])
+        touched = set(keys) | {yesterday[:7]}
+        yesterdays_properties = []
+        changed = self.manifest.get("index_shards") != self.index_shards
+
+        # Only the months that received rows (plus yesterday's) are read and rewritten
+        for partition in sorted(touched):
+            history, sha = self.read_partition(partition)
+            merged = merge_history(history, new_properties[(keys == partition).values])
+
+            if len(merged) != len(history):
+                logging.info(f"Appending {len(merged) - len(history)} rows to {self.partition_path(partition)}")
+                self.write(self.partition_path(partition), self.serialize(merged), sha, commit_message)
+                self.manifest["partitions"][partition] = {
+                    "rows": len(merged),
+                    "updated_at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+                }
+                changed = True
+
+            yesterdays_properties.append(merged.loc[merged["added_on"] == yesterday])
+
+        if changed:
+            self.manifest["index_shards"] = self.index_shards
+            self.save_manifest(commit_message)
+
+        self.index.update(new_properties, keys)
+        for shard in sorted(self.index.changed):
+            self.index_shas[shard] = self.write(self.index_path(shard), self.index.dumps(shard), self.index_shas.get(shard), commit_message)
+        self.index.changed.clear()
+
+        return pd.concat(yesterdays_properties)
+
+    def load_index(self, listing_ids):
+        if self.index is None:
+            self.index = ListingIndex(self.portal, self.index_shards)
+            if self.manifest.get("index_shards") != self.index_shards:
+                self.build_index()
+
+        for shard in sorted({self.index.shard(listing_id) for listing_id in listing_ids if isinstance(listing_id, str)} - set(self.index_shas)):
+            content, self.index_shas[shard] = self.read(self.index_path(shard))
+            if content is not None:
+                self.index.loads(content.decode('utf-8'))
+
+        return self.index
+
+    def build_index(self):
+        # Stores from before the index was sharded (or before it existed) are indexed in full once, then every shard is written
+        content, _ = self.read(self.legacy_index_path) if "index_shards" not in self.manifest else (None, None)
+        if content is not None:
+            self.index.loads(content.decode('utf-8'))
+        else:
+            for partition in sorted(self.manifest["partitions"]):
+                history, _ = self.read_partition(partition)
+                history["listing_id"] = Parser.listing_ids(history["url"])
+                # Rows are newest first, so updating in reverse leaves each listing's latest content indexed
+                history = history.iloc[::-1]
+                self.index.update(history, [partition] * len(history))
+
+        # Shards laid out under another count are read for their sha only, so they can be overwritten
+        if "index_shards" in self.manifest:
+            self.index_shas = {shard: self.read(self.index_path(shard))[1] for shard in range(self.index_shards)}
+        self.index.changed = {self.index.shard(listing_id) for _, listing_id in self.index.entries}
+        self.index.changed |= {shard for shard, sha in self.index_shas.items() if sha is not None}
+        self.index_shas.update({shard: self.index_shas.get(shard) for shard in range(self.index_shards)})
+
+    def load_manifest(self):
+        if self.manifest is not None:
+            return self.manifest
+
+        content, self.manifest_sha = self.read(self.manifest_path)
+        if content is None:
+            self.manifest = {"partitions": {}}
+            if self.legacy_path is not None:
+                self.migrate()
+        else:
+            self.manifest = json.loads(content.decode('utf-8'))
+
+        return self.manifest
+
+    def save_manifest(self, commit_message):
+        content = json.dumps(self.manifest, indent=2, sort_keys=True)
+        self.manifest_sha = self.write(self.manifest_path, content, self.manifest_sha, commit_message)
+
+    def read_all(self):
+        self.load_manifest()
+        return pd.concat([self.read_partition(partition)[0] for partition in sorted(self.manifest["partitions"])])
+
+    def read_partition(self, partition: str):
+        if partition not in self.manifest["partitions"]:
+            return pd.DataFrame(), None
+
+        content, sha = self.read(self.partition_path(partition))
+        if content is None:
+            return pd.DataFrame(), None
+        return self.deserialize(content), sha
+
+    def migrate(self):
+        # One-off split of the legacy single-file history into monthly partitions
+        logging.info(f"Migrating {self.legacy_path} into {self.root}")
+
+        repo_csv = self.repo.get_contents(self.legacy_path)
+        encoded_blob_csv = self.repo.get_git_blob(repo_csv.sha)
+        decoded_blob_csv = base64.b64decode(encoded_blob_csv.content).decode('utf-8')
+        history = pd.read_csv(io.StringIO(decoded_blob_csv), encoding_errors='replace')
+
+        commit_message = f"Partitioning {self.legacy_path} into {self.root}"
+        for partition, rows in history.groupby(self.partition_keys(history["added_on"])):
+            self.write(self.partition_path(partition), self.serialize(rows), None, commit_message)
+            self.manifest["partitions"][partition] = {
+                "rows": len(rows),
+                "updated_at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+            }
+
+        self.save_manifest(commit_message)
+
+    def read(self, path: str):
+        return read_file(self.repo, path)
+
+    def write(self, path: str, content, sha, commit_message):
+        return write_file(self.repo, path, content, sha, commit_message)
+
+
+class MatchHistory:
+    path = "history/matches.csv"
+    columns = ["rightmove_id", "zoopla_id", "rightmove_url", "zoopla_url", "similarity", "matched_on"]
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def append(self, matches, commit_message, today):
+        content, sha = read_file(self.repo, self.path)
+        history = pd.DataFrame(columns=self.columns) if content is None else \
+            pd.read_csv(io.BytesIO(content), dtype={"rightmove_id": str, "zoopla_id": str})
+
+        links = pd.concat([history, matches.assign(matched_on=today)])
+        links = links.drop_duplicates(subset=["rightmove_id", "zoopla_id"], keep="first")[self.columns]
+
+        if len(links) != len(history):
+            logging.info(f"Recording {len(links) - len(history)} new cross-portal matches")
+            write_file(self.repo, self.path, links.to_csv(index=False), sha, commit_message)
+
+        # A listing keeps only its most recent link, in case either portal relisted it under a new ID
+        return links.iloc[::-1].drop_duplicates(subset=["rightmove_id"]).drop_duplicates(subset=["zoopla_id"])
+
+
+def read_file(repo, path: str):
+    try:
+        with metrics.timed(metrics.GITHUB_SECONDS, operation="read"):
+            contents = repo.get_contents(path)
+            if contents.size < GITHUB_CONTENTS_LIMIT:
+                content = contents.decoded_content
+            else:
+                # The contents API leaves files over 1 MB out of its response; the blob API serves them at any size
+                content = base64.b64decode(repo.get_git_blob(contents.sha).content)
+    except UnknownObjectException:
+        return None, None
+
+    metrics.GITHUB_BYTES.inc(len(content), operation="read")
+    return content, contents.sha
+
+
+def write_file(repo, path: str, content, sha, commit_message):
+    if isinstance(content, str):
+        content = bytes(content, encoding='utf-8')
+
+    # Writes are staged in memory and reach GitHub in the run's commit, which is what the GitHub metrics record
+    if sha is None:
+        result = repo.create_file(path=path, message=commit_message, content=content)
+    else:
+        result = repo.update_file(path=path, message=commit_message, content=content, sha=sha)
+
+    return result["content"].sha
@@ -0,0 +1,143 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import types
+import urllib.parse
+
+import metrics
+
+
+class ResponseCache:
+
+    def __init__(self, path: str, ttl: float = 6 * 60 * 60, max_bytes: int = 200_000_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(url: str):
+        # Same page regardless of host case, query parameter order or fragment
+        parts = urllib.parse.urlsplit(url)
+        query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+        return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+    def get(self, url: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT headers, body, stored_at FROM responses WHERE url = ?", (self.key(url),)).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE url = ?", (time.time(), self.key(url)))
+            self.connection.commit()
+
+        headers, body, stored_at = row
+        return CachedResponse(url, json.loads(headers), gzip.decompress(body), stored_at)
+
+    def put(self, url: str, headers, content: bytes):
+        body = gzip.compress(content)
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (url, headers, body, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(url), json.dumps(headers), body, len(body), now, now))
+            self.evict()
+            self.connection.commit()
+
+    def touch(self, url: str):
+        with self.lock:
+            now = time.time()
+            self.connection.execute("UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?", (now, now, self.key(url)))
+            self.connection.commit()
+
+    def evict(self):
+        # Drop least recently used responses until the stored (compressed) size is back under the bound
+        total, = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        for url, size in self.connection.execute("SELECT url, size FROM responses ORDER BY accessed_at").fetchall():
+            self.connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedResponse:
+
+    def __init__(self, url, headers, content, stored_at):
+        self.url = url
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at
+
+    def fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+    def validators(self):
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def response(self):
+        return types.SimpleNamespace(url=self.url, status_code=200, headers=self.headers, content=self.content)
+
+
+class CachedSession:
+
+    def __init__(self, session, cache: ResponseCache):
+        self.session = session
+        self.cache = cache
+
+    def get(self, url, headers=None, **kwargs):
+        cached = self.cache.get(url)
+        if cached is not None and cached.fresh(self.cache.ttl):
+            logging.info(f"Serving {url} from the response cache")
+            metrics.HTTP_CACHE_REQUESTS.inc(result="hit")
+            return cached.response()
+
+        # A stale entry is revalidated rather than refetched when the server gave us validators
+        validators = cached.validators() if cached is not None else {}
+        response = self.session.get(url, headers={**(headers or {}), **validators}, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            self.cache.touch(url)
+            metrics.HTTP_CACHE_REQUESTS.inc(result="revalidated")
+            return cached.response()
+
+        metrics.HTTP_CACHE_REQUESTS.inc(result="miss")
+        if response.status_code == 200:
+            kept = {name: response.headers[name] for name in ("ETag", "Last-Modified", "Content-Type") if name in response.headers}
+            self.cache.put(url, kept, response.content)
+
+        return response
+
+    def close(self):
+        self.session.close()
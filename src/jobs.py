@@ -0,0 +1,155 @@
+import datetime as dt
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = self.QUEUED
+        self.created_at = now()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.progress = {}
+
+    @property
+    def finished(self):
+        return self.state in (self.SUCCEEDED, self.FAILED)
+
+    def status(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "progress": dict(self.progress),
+        }
+
+
+class JobRunner:
+
+    def __init__(self, max_history: int = 20):
+        self.max_history = max_history
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args) -> Job:
+        with self.lock:
+            # Only one run at a time: a second trigger gets the run already in progress
+            for job in self.jobs.values():
+                if job.name == func.__name__ and not job.finished:
+                    return job
+
+            job = Job(func.__name__)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_history:
+                self.jobs.popitem(last=False)
+
+        self.executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def _run(job, func, args):
+        job.state = Job.RUNNING
+        job.started_at = now()
+        logging.info(f"Starting job {job.name} ({job.id})")
+
+        try:
+            func(job, *args)
+            job.state = Job.SUCCEEDED
+        except Exception as error:
+            logging.exception(f"Job {job.name} ({job.id}) failed")
+            job.error = repr(error)
+            job.state = Job.FAILED
+        finally:
+            job.finished_at = now()
+
+
+class RegionCheckpoints:
+    slug_pattern = re.compile(r"[^A-Za-z0-9]+")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, search):
+        return os.path.join(self.directory, search.portal, f"{self.slug_pattern.sub('-', search.location_identifier)}.json")
+
+    def exists(self, search):
+        return os.path.isfile(self.path(search))
+
+    def save(self, search, records: list):
+        path = self.path(search)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename so an interrupted run never leaves a truncated checkpoint behind
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(records, file)
+        os.replace(f"{path}.tmp", path)
+
+    def load(self, search):
+        with open(self.path(search)) as file:
+            return json.load(file)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class BucketCheckpoints(RegionCheckpoints):
+    # Cloud Storage outlives the instance; on App Engine the temp directory is memory and goes with it
+
+    def __init__(self, url: str):
+        from google.cloud import storage
+
+        bucket, _, prefix = url[len("gs://"):].partition("/")
+        super().__init__(prefix.strip("/"))
+        self.bucket = storage.Client().bucket(bucket)
+
+    def exists(self, search):
+        return self.bucket.blob(self.path(search)).exists()
+
+    def save(self, search, records: list):
+        # A single object upload is atomic, so there is no partial checkpoint to guard against
+        self.bucket.blob(self.path(search)).upload_from_string(json.dumps(records), content_type="application/json")
+
+    def load(self, search):
+        return json.loads(self.bucket.blob(self.path(search)).download_as_bytes())
+
+    def clear(self):
+        for blob in self.bucket.list_blobs(prefix=f"{self.directory}/"):
+            blob.delete()
+
+
+def create_checkpoints(location: str, day: str):
+    if location.startswith("gs://"):
+        return BucketCheckpoints(f"{location.rstrip('/')}/{day}")
+    return RegionCheckpoints(os.path.join(location, day))
+
+
+def now():
+    return dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")
@@ -1,21 +1,13 @@
-import base64
-import io
 import os
 
-import pytz
 import atexit
 
-import datetime as dt
-import pandas as pd
-
-from rightmove import RightmovePropertiesForSale
-from zoopla import ZooplaPropertiesForSale
-from email_handler import EmailSender
+import metrics
+from credentials import cloud_logging
+from jobs import JobRunner
 
 from dotenv import load_dotenv
-from flask import Flask
-from github import Github
-from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, jsonify, request
 
 # [START gae_python39_warmup_app]
 # [START gae_python3_warmup_app]
@@ -24,111 +16,105 @@ load_dotenv()
 app = Flask(__name__)
 
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "ENVIRONMENT environment variable is not set.")
-REPOSITORY = os.environ.get("REPOSITORY", "REPOSITORY environment variable is not set.")
-
-if ENVIRONMENT == 'gcloud':
-    import google.cloud.logging
-    import google.auth
-    from google.cloud import secretmanager
 
-    # Logging
-    client = google.cloud.logging.Client()
-    client.setup_logging()
+jobs = JobRunner()
+atexit.register(jobs.shutdown)
 
-    # Secrets
-    secrets = secretmanager.SecretManagerServiceClient()
-    _, project_id = google.auth.default()
-    GITHUB_ACCESS_TOKEN = secrets.access_secret_version(request={"name": f"projects/{project_id}/secrets/github-access-token/versions/latest"}).payload.data.decode("utf-8")
-else:
-    GITHUB_ACCESS_TOKEN = os.environ.get("GITHUB_ACCESS_TOKEN", "GITHUB_ACCESS_TOKEN environment variable is not set.")
 
-scheduler = BackgroundScheduler()
-atexit.register(lambda: scheduler.shutdown())
+def run_nightly(job, crawl_mode=None):
+    # The pipeline (pandas, lxml, GitHub, SendGrid) is only imported once a run or a warmup needs it
+    import nightly
 
-g = Github(GITHUB_ACCESS_TOKEN)
+    cloud_logging.get()
+    return nightly.nightly_run(job, crawl_mode or nightly.CRAWL_MODE)
 
 
 @app.route('/')
 def main():
-    repo = g.get_user().get_repo(REPOSITORY)
-
-    london_tzinfo = pytz.timezone("Europe/London")
-    yesterday = (dt.datetime.now(dt.timezone.utc).astimezone(london_tzinfo) - dt.timedelta(days=1)).strftime("%Y-%m-%d")
-
-    yesterdays_rightmove_houses = process_csv(
-        repo,
-        pd.concat([
-            RightmovePropertiesForSale(location_identifier='REGION^93929', radius_from_location=1, ).parse_site(),  # barnet
-            RightmovePropertiesForSale(location_identifier='REGION^1017', radius_from_location=1, ).parse_site(),  # northwood
-            RightmovePropertiesForSale(location_identifier='REGION^1154', radius_from_location=1, ).parse_site(),  # ruislip
-            RightmovePropertiesForSale(location_identifier='REGION^79781', radius_from_location=0.5, ).parse_site(),  # harrow_on_the_hill
-            RightmovePropertiesForSale(location_identifier='REGION^896', radius_from_location=1, ).parse_site(),  # maidenhead
-            RightmovePropertiesForSale(location_identifier='REGION^311', radius_from_location=1, ).parse_site(),  # chesham
-            RightmovePropertiesForSale(location_identifier='REGION^36', radius_from_location=1, ).parse_site(),  # amersham
-            RightmovePropertiesForSale(location_identifier='REGION^5133', radius_from_location=1, ).parse_site(),  # burnham
-            RightmovePropertiesForSale(location_identifier='REGION^23997', radius_from_location=1, ).parse_site(),  # taplow
-            RightmovePropertiesForSale(location_identifier='REGION^1070', radius_from_location=0, ).parse_site(),  # pinner
-        ]),
-        "rightmove-houses.csv",
-        f"Updating rightmove-houses.csv - {dt.datetime.now().strftime('%d/%m/%Y')}",
-        yesterday
-    )
+    # The run outlives the request; poll /jobs/<id> for its progress
+    job = jobs.submit(run_nightly, request.args.get("crawl"))
+    return jsonify(job.status()), 202, {"Location": f"/jobs/{job.id}"}
 
-    yesterdays_zoopla_houses = process_csv(
-        repo,
-        pd.concat([
-            ZooplaPropertiesForSale(location_identifier='barnet-london-borough', radius_from_location=1, ).parse_site(),  # barnet
-            ZooplaPropertiesForSale(location_identifier='london/northwood', radius_from_location=1, ).parse_site(),  # northwood
-            ZooplaPropertiesForSale(location_identifier='ruislip', radius_from_location=1, ).parse_site(),  # ruislip
-            ZooplaPropertiesForSale(location_identifier='harrow-on-the-hill', radius_from_location=1, ).parse_site(),  # harrow-on-the-hill
-            ZooplaPropertiesForSale(location_identifier='maidenhead', radius_from_location=1, ).parse_site(),  # maidenhead
-            ZooplaPropertiesForSale(location_identifier='chesham', radius_from_location=1, ).parse_site(),  # chesham
-            ZooplaPropertiesForSale(location_identifier='amersham', radius_from_location=1, ).parse_site(),  # amersham
-            ZooplaPropertiesForSale(location_identifier='berkshire/burnham', radius_from_location=1, ).parse_site(),  # burnham
-            ZooplaPropertiesForSale(location_identifier='taplow', radius_from_location=1, ).parse_site(),  # taplow
-            ZooplaPropertiesForSale(location_identifier='pinner', radius_from_location=0, ).parse_site(),  # pinner
-        ]),
-        "zoopla-houses.csv",
-        f"Updating zoopla-houses.csv - {dt.datetime.now().strftime('%d/%m/%Y')}",
-        yesterday
-    )
 
-    # Send email
-    EmailSender(pd.concat([yesterdays_rightmove_houses, yesterdays_zoopla_houses]))
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404, {}
+
+    return jsonify(job.status()), 200, {}
 
-    return '', 200, {}
 
+@app.route('/analytics/prices')
+def price_analytics():
+    import nightly
 
-def process_csv(repo, new_properties, path, commit_message, yesterday):
-    repo_csv = repo.get_contents(path)
-    encoded_blob_csv = repo.get_git_blob(repo_csv.sha)
-    decoded_blob_csv = base64.b64decode(encoded_blob_csv.content).decode('utf-8')
-    csv = pd.concat([
-        pd.read_csv(io.StringIO(decoded_blob_csv), encoding_errors='replace'),
-        new_properties
-    ])
+    # Asking-price statistics per (portal, postcode, bedrooms, month), optionally merged over the dimensions left out of group_by
+    group_by = request.args.get("group_by")
+    postcode = request.args.get("postcode")
+    rows = nightly.get_rollups().query(
+        group_by.split(",") if group_by else None,
+        portal=request.args.get("portal"),
+        postcode=postcode.upper() if postcode else None,
+        bedrooms=request.args.get("bedrooms", type=int),
+        month=request.args.get("month"),
+    )
+    return jsonify(rows), 200, {}
+
+
+@app.route('/listings/search')
+def search_listings():
+    import nightly
+    from geo import KM_PER_MILE
 
-    csv['added_on'] = pd.to_datetime(csv['added_on'], dayfirst=True)
-    csv = csv.sort_values("added_on", ascending=False)
-    csv["added_on"] = csv["added_on"].astype('str')
+    # Either a radius around lat/lon or a postcode district's centroid (`near`), or a bbox of south,west,north,east
+    index = nightly.get_spatial_index()
+    filters = {name: request.args.get(name, type=float) for name in ("min_price", "max_price", "min_bedrooms", "max_bedrooms")}
 
-    csv = csv.drop_duplicates(subset=csv.columns.difference(["search_datetime", "added_on"]), keep="first")
-    yesterdays_properties = csv.loc[csv["added_on"] == yesterday]
+    if "bbox" in request.args:
+        try:
+            south, west, north, east = (float(value) for value in request.args["bbox"].split(","))
+        except ValueError:
+            return jsonify({"error": "bbox must be south,west,north,east"}), 400, {}
+        results = index.bounding_box(south, west, north, east, **filters)
+    else:
+        if "near" in request.args:
+            centre = index.districts.centroid(request.args["near"])
+            if centre is None:
+                return jsonify({"error": f"Unknown postcode district {request.args['near']}"}), 400, {}
+        else:
+            centre = (request.args.get("lat", type=float), request.args.get("lon", type=float))
+            if None in centre:
+                return jsonify({"error": "Pass lat and lon, near or bbox"}), 400, {}
+        results = index.radius(*centre, request.args.get("radius_miles", 1.0, type=float) * KM_PER_MILE, **filters)
 
-    csv_format = csv.to_csv(index=False, encoding='utf-8')
+    listings = results.head(request.args.get("limit", 100, type=int)).astype(object)
+    return jsonify({"count": len(results), "listings": listings.where(listings.notnull(), None).to_dict(orient="records")}), 200, {}
 
-    repo.update_file(path=path, message=commit_message, content=bytes(csv_format, encoding='utf-8'), sha=repo_csv.sha)
 
-    return yesterdays_properties
+@app.route('/metrics')
+def export_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 
 if ENVIRONMENT == 'local':
+    from apscheduler.schedulers.background import BackgroundScheduler
+
     print('Starting scheduler for nightly processing')
-    scheduler.add_job(func=main, trigger='cron', hour=5, minute=55)
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=jobs.submit, args=[run_nightly], trigger='cron', hour=5, minute=55)
     scheduler.start()
+    atexit.register(lambda: scheduler.shutdown())
 
+@app.route('/_ah/start')
 @app.route('/_ah/warmup')
 def warmup():
-    # Handle your warmup logic here, e.g. set up a database connection pool
+    # Pay the cold start here rather than in the first run: logging, the pipeline imports, secrets and clients.
+    # Basic scaling never sends warmup requests; it starts each instance with /_ah/start instead
+    import nightly
+
+    cloud_logging.get()
+    nightly.warm_up()
     return '', 200, {}
 
 
@@ -0,0 +1,121 @@
+import logging
+import re
+
+from collections import defaultdict
+
+import pandas as pd
+
+
+class ListingMatcher:
+    postcode_pattern = re.compile(r"\b[a-z]{1,2}[0-9][0-9a-z]?(?:\s*[0-9][a-z]{2})?\b")
+    punctuation_pattern = re.compile(r"[^a-z0-9\s]")
+    abbreviations = {
+        "road": "rd", "street": "st", "avenue": "ave", "gardens": "gdns", "close": "cl", "drive": "dr",
+        "lane": "ln", "crescent": "cres", "place": "pl", "court": "ct", "terrace": "ter", "grove": "gr",
+    }
+    abbreviation_pattern = re.compile(r"\b(" + "|".join(abbreviations) + r")\b")
+    stopwords = {"london", "the"}
+
+    def __init__(self, price_band: int = 25_000, price_tolerance: float = 0.05, min_similarity: float = 0.5):
+        self.price_band = price_band
+        self.price_tolerance = price_tolerance
+        self.min_similarity = min_similarity
+
+    @classmethod
+    def normalize_addresses(cls, addresses):
+        normalized = addresses.astype(str).str.lower()
+        normalized = normalized.str.replace(cls.punctuation_pattern, " ", regex=True)
+        normalized = normalized.str.replace(cls.postcode_pattern, " ", regex=True)
+        normalized = normalized.str.replace(cls.abbreviation_pattern, lambda m: cls.abbreviations[m.group(1)], regex=True)
+        return normalized.str.split().map(lambda tokens: frozenset(t for t in tokens if t not in cls.stopwords))
+
+    @classmethod
+    def streets(cls, addresses):
+        street = addresses.astype(str).str.split(",").str[0].str.lower()
+        street = street.str.replace(cls.punctuation_pattern, " ", regex=True)
+        street = street.str.replace(cls.abbreviation_pattern, lambda m: cls.abbreviations[m.group(1)], regex=True)
+        return street.str.split().str.join(" ")
+
+    def prepare(self, frame):
+        prepared = frame.drop_duplicates(subset=["listing_id"]).reset_index(drop=True)
+        return pd.DataFrame({
+            "listing_id": prepared["listing_id"],
+            "url": prepared["url"],
+            "price": pd.to_numeric(prepared["price"], errors="coerce"),
+            "bedrooms": pd.to_numeric(prepared["number_bedrooms"], errors="coerce").fillna(-1).astype(int),
+            "postcode": prepared["postcode"].astype(str).str.upper().where(prepared["postcode"].notnull()),
+            "street": self.streets(prepared["address"]),
+            "tokens": self.normalize_addresses(prepared["address"]),
+        })
+
+    def build_index(self, candidates):
+        # Blocking index: (postcode or street, bedrooms, price band) -> candidate row numbers
+        index = defaultdict(list)
+        for row, (postcode, street, bedrooms, price) in enumerate(
+                zip(candidates["postcode"], candidates["street"], candidates["bedrooms"], candidates["price"])):
+            if pd.isnull(price):
+                continue
+            band = int(price // self.price_band)
+            index[("postcode", postcode, bedrooms, band)].append(row)
+            index[("street", street, bedrooms, band)].append(row)
+        return index
+
+    def probe_keys(self, postcode, street, bedrooms, price):
+        low = int(price * (1 - self.price_tolerance) // self.price_band)
+        high = int(price * (1 + self.price_tolerance) // self.price_band)
+        for band in range(low, high + 1):
+            if isinstance(postcode, str):
+                yield "postcode", postcode, bedrooms, band
+            yield "street", street, bedrooms, band
+
+    def match(self, rightmove, zoopla):
+        columns = ["rightmove_id", "zoopla_id", "rightmove_url", "zoopla_url", "similarity"]
+        if len(rightmove) == 0 or len(zoopla) == 0:
+            return pd.DataFrame(columns=columns)
+
+        left, right = self.prepare(rightmove), self.prepare(zoopla)
+        index = self.build_index(right)
+
+        right_ids, right_urls = right["listing_id"].tolist(), right["url"].tolist()
+        right_prices, right_tokens = right["price"].tolist(), right["tokens"].tolist()
+
+        pairs = []
+        for row in left.itertuples(index=False):
+            if pd.isnull(row.price):
+                continue
+
+            candidates = {c for key in self.probe_keys(row.postcode, row.street, row.bedrooms, row.price) for c in index.get(key, ())}
+            for candidate in candidates:
+                price = right_prices[candidate]
+                if abs(price - row.price) > self.price_tolerance * max(price, row.price):
+                    continue
+                union = row.tokens | right_tokens[candidate]
+                similarity = len(row.tokens & right_tokens[candidate]) / len(union) if union else 0.0
+                if similarity >= self.min_similarity:
+                    pairs.append((similarity, row.listing_id, right_ids[candidate], row.url, right_urls[candidate]))
+
+        # Greedily keep the most similar pairs so each listing is linked at most once
+        matches, used_left, used_right = [], set(), set()
+        for similarity, left_id, right_id, left_url, right_url in sorted(pairs, key=lambda p: p[0], reverse=True):
+            if left_id in used_left or right_id in used_right:
+                continue
+            used_left.add(left_id)
+            used_right.add(right_id)
+            matches.append((left_id, right_id, left_url, right_url, similarity))
+
+        logging.info(f"Matched {len(matches)} listings across {len(left)} Rightmove and {len(right)} Zoopla listings")
+
+        return pd.DataFrame(matches, columns=columns)
+
+    @staticmethod
+    def merge(rightmove, zoopla, matches):
+        # One row per house: Rightmove rows carry their Zoopla link, and linked Zoopla rows are folded into them
+        links = matches.set_index("rightmove_id")["zoopla_url"]
+        reverse_links = matches.set_index("zoopla_id")["rightmove_url"]
+
+        rightmove = rightmove.assign(rightmove_url=rightmove["url"], zoopla_url=rightmove["listing_id"].map(links))
+
+        zoopla = zoopla.assign(rightmove_url=zoopla["listing_id"].map(reverse_links), zoopla_url=zoopla["url"])
+        zoopla = zoopla[~(zoopla["rightmove_url"].notnull() & zoopla["rightmove_url"].isin(rightmove["rightmove_url"]))]
+
+        return pd.concat([rightmove, zoopla]).reset_index(drop=True)
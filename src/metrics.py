@@ -0,0 +1,142 @@
+import bisect
+import contextlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Counter:
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.snapshot().items()):
+            lines.append(f"{self.name}{format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                counts[position] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', f'{bucket:g}'),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in key) + "}"
+
+
+@contextlib.contextmanager
+def timed(histogram: Histogram, **labels):
+    # Works as both a `with` block and a function decorator
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+REQUEST_SECONDS = Histogram("portal_request_seconds", "Latency of portal page requests")
+QUEUE_SECONDS = Histogram("portal_request_queue_seconds", "Time portal requests wait for a host's concurrency and rate limits")
+REQUEST_ERRORS = Counter("portal_request_errors_total", "Portal requests that did not return 200")
+BYTES_DOWNLOADED = Counter("portal_bytes_downloaded_total", "Bytes of portal HTML downloaded")
+PAGES_FETCHED = Counter("portal_pages_fetched_total", "Portal result pages fetched")
+HTTP_CACHE_REQUESTS = Counter("http_cache_requests_total", "Portal requests by response cache outcome")
+REGION_SECONDS = Histogram("region_crawl_seconds", "Time to fetch every result page of a search region")
+PARSE_SECONDS = Histogram("page_parse_seconds", "Time to parse a result page into listing records")
+ROWS_EXTRACTED = Counter("listing_rows_extracted_total", "Listing records extracted from result pages")
+NORMALIZE_SECONDS = Histogram("normalize_seconds", "Time to normalize a portal's listings")
+GITHUB_SECONDS = Histogram("github_request_seconds", "Latency of GitHub reads and commits")
+GITHUB_BYTES = Counter("github_bytes_total", "Bytes read from and committed to GitHub")
+DEDUP_ROWS = Counter("dedup_rows_total", "Scraped rows by deduplication outcome")
+EMAIL_SECONDS = Histogram("email_send_seconds", "Time to render and send the email digest")
+EMAILS_SENT = Counter("emails_sent_total", "Email digests sent by outcome")
+RUN_SECONDS = Histogram("run_seconds", "Duration of a whole nightly run", buckets=(10, 30, 60, 90, 120, 180, 300, 600))
+
+REGISTRY = [REQUEST_SECONDS, QUEUE_SECONDS, REQUEST_ERRORS, BYTES_DOWNLOADED, PAGES_FETCHED, HTTP_CACHE_REQUESTS, REGION_SECONDS, PARSE_SECONDS, ROWS_EXTRACTED,
+            NORMALIZE_SECONDS, GITHUB_SECONDS, GITHUB_BYTES, DEDUP_ROWS, EMAIL_SECONDS, EMAILS_SENT, RUN_SECONDS]
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class RunSummary:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.baseline = {metric.name: metric.snapshot() for metric in REGISTRY}
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        RUN_SECONDS.observe(elapsed)
+
+        # Report only what changed during this run, flattened to "name{labels}" keys
+        summary = {"run_seconds": round(elapsed, 3)}
+        for metric in REGISTRY:
+            baseline = self.baseline.get(metric.name, {})
+            for key, value in metric.snapshot().items():
+                name = f"{metric.name}{format_labels(key)}"
+                if isinstance(metric, Counter):
+                    delta = value - baseline.get(key, 0)
+                    if delta:
+                        summary[name] = delta
+                else:
+                    _, total, count = value
+                    _, base_total, base_count = baseline.get(key, (None, 0.0, 0))
+                    if count - base_count:
+                        summary[f"{name}_count"] = count - base_count
+                        summary[f"{name}_sum"] = round(total - base_total, 3)
+
+        dedup = {key: value - self.baseline[DEDUP_ROWS.name].get(key, 0) for key, value in DEDUP_ROWS.snapshot().items()}
+        seen = sum(dedup.values())
+        if seen:
+            duplicates = sum(value for key, value in dedup.items() if dict(key).get("result") in ("unchanged", "duplicate"))
+            summary["dedup_hit_rate"] = round(duplicates / seen, 4)
+
+        return summary
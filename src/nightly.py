@@ -0,0 +1,370 @@
+import base64
+import io
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+
+import pytz
+
+import datetime as dt
+import pandas as pd
+
+from rightmove import RightmovePropertiesForSale
+from zoopla import ZooplaPropertiesForSale
+from email_handler import EmailSender, sendgrid_client
+from alerts import AlertMatcher, Subscriptions
+from parse import Parser
+from history import MatchHistory, PartitionedHistory, merge_history, new_rows
+from matching import ListingMatcher
+from analytics import MarketRollups
+from geo import PostcodeDistricts, SpatialIndex
+from timeline import ListingTimeline
+from crawler import CrawlScheduler, HostLimit, ParsePool
+from jobs import create_checkpoints
+from watermark import Watermarks
+import metrics
+from credentials import ENVIRONMENT, Lazy, SECRET_REFRESH_SECONDS, secrets
+from commits import BatchedRepository
+from http_cache import CachedSession, ResponseCache
+from replay import LocalGitRepository, LocalRepository, LocalSendGridClient, RecordingSession, ReplaySession
+
+from dotenv import load_dotenv
+from github import Github
+
+load_dotenv()
+
+REPOSITORY = os.environ.get("REPOSITORY", "REPOSITORY environment variable is not set.")
+CRAWL_MAX_WORKERS = int(os.environ.get("CRAWL_MAX_WORKERS", 8))
+# Parser processes; 0 parses in the crawl threads. One core is left for fetching and the rest of the run
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", max((os.cpu_count() or 1) - 1, 0)))
+PARSE_QUEUE_SIZE = int(os.environ.get("PARSE_QUEUE_SIZE", 16))
+HISTORY_MODE = os.environ.get("HISTORY_MODE", "csv")
+HISTORY_FORMAT = os.environ.get("HISTORY_FORMAT", "csv")
+REPLAY_MODE = os.environ.get("REPLAY_MODE", "off")
+REPLAY_DIR = os.environ.get("REPLAY_DIR", "fixtures")
+REPLAY_REPOSITORY = os.environ.get("REPLAY_REPOSITORY", "directory")
+# A local directory or gs://bucket/prefix; on App Engine the default bucket is used, as /tmp doesn't survive the instance
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR") or (
+    f"gs://{os.environ['GOOGLE_CLOUD_PROJECT']}.appspot.com/checkpoints" if ENVIRONMENT == 'gcloud' and "GOOGLE_CLOUD_PROJECT" in os.environ
+    else os.path.join(tempfile.gettempdir(), "property-tracking"))
+REGION_RETRIES = int(os.environ.get("REGION_RETRIES", 3))
+REGION_RETRY_BACKOFF = float(os.environ.get("REGION_RETRY_BACKOFF", 30))
+CRAWL_MODE = os.environ.get("CRAWL_MODE", "full")
+FULL_CRAWL_WEEKDAY = int(os.environ.get("FULL_CRAWL_WEEKDAY", 6))
+HTTP_CACHE_PATH = os.environ.get("HTTP_CACHE_PATH", os.path.join(tempfile.gettempdir(), "property-tracking-cache.sqlite"))
+HTTP_CACHE_TTL = float(os.environ.get("HTTP_CACHE_TTL", 6 * 60 * 60))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", 200_000_000))
+
+market_rollups = None
+spatial_index = None
+
+# An empty HTTP_CACHE_PATH turns the response cache off
+response_cache = ResponseCache(HTTP_CACHE_PATH, HTTP_CACHE_TTL, HTTP_CACHE_MAX_BYTES) if HTTP_CACHE_PATH and REPLAY_MODE != 'replay' else None
+
+# Rebuilt after SECRET_REFRESH_SECONDS so a rotated token is picked up without a redeploy
+github = Lazy(lambda: Github(secrets.get("github-access-token")), SECRET_REFRESH_SECONDS)
+repository = Lazy(lambda: github.get().get_user().get_repo(REPOSITORY), SECRET_REFRESH_SECONDS)
+
+
+def warm_up():
+    # Everything a run needs before its first request: secrets, the GitHub repository and the SendGrid client
+    get_repository()
+    if create_email_client() is None:
+        sendgrid_client.get()
+
+
+def nightly_run(job, crawl_mode=CRAWL_MODE):
+    run = metrics.RunSummary()
+    # Every file the run writes is staged and committed together at the end
+    repo = BatchedRepository(get_repository())
+
+    london_tzinfo = pytz.timezone("Europe/London")
+    today = dt.datetime.now(dt.timezone.utc).astimezone(london_tzinfo).strftime("%Y-%m-%d")
+    yesterday = (dt.datetime.now(dt.timezone.utc).astimezone(london_tzinfo) - dt.timedelta(days=1)).strftime("%Y-%m-%d")
+
+    # Incremental runs still fall back to a full crawl once a week to reconcile removals
+    incremental = crawl_mode == 'incremental' and dt.date.fromisoformat(today).weekday() != FULL_CRAWL_WEEKDAY
+    job.progress.update(crawl_mode='incremental' if incremental else 'full')
+
+    rightmove_searches = [
+        RightmovePropertiesForSale(location_identifier='REGION^93929', radius_from_location=1, ),  # barnet
+        RightmovePropertiesForSale(location_identifier='REGION^1017', radius_from_location=1, ),  # northwood
+        RightmovePropertiesForSale(location_identifier='REGION^1154', radius_from_location=1, ),  # ruislip
+        RightmovePropertiesForSale(location_identifier='REGION^79781', radius_from_location=0.5, ),  # harrow_on_the_hill
+        RightmovePropertiesForSale(location_identifier='REGION^896', radius_from_location=1, ),  # maidenhead
+        RightmovePropertiesForSale(location_identifier='REGION^311', radius_from_location=1, ),  # chesham
+        RightmovePropertiesForSale(location_identifier='REGION^36', radius_from_location=1, ),  # amersham
+        RightmovePropertiesForSale(location_identifier='REGION^5133', radius_from_location=1, ),  # burnham
+        RightmovePropertiesForSale(location_identifier='REGION^23997', radius_from_location=1, ),  # taplow
+        RightmovePropertiesForSale(location_identifier='REGION^1070', radius_from_location=0, ),  # pinner
+    ]
+
+    zoopla_searches = [
+        ZooplaPropertiesForSale(location_identifier='barnet-london-borough', radius_from_location=1, ),  # barnet
+        ZooplaPropertiesForSale(location_identifier='london/northwood', radius_from_location=1, ),  # northwood
+        ZooplaPropertiesForSale(location_identifier='ruislip', radius_from_location=1, ),  # ruislip
+        ZooplaPropertiesForSale(location_identifier='harrow-on-the-hill', radius_from_location=1, ),  # harrow-on-the-hill
+        ZooplaPropertiesForSale(location_identifier='maidenhead', radius_from_location=1, ),  # maidenhead
+        ZooplaPropertiesForSale(location_identifier='chesham', radius_from_location=1, ),  # chesham
+        ZooplaPropertiesForSale(location_identifier='amersham', radius_from_location=1, ),  # amersham
+        ZooplaPropertiesForSale(location_identifier='berkshire/burnham', radius_from_location=1, ),  # burnham
+        ZooplaPropertiesForSale(location_identifier='taplow', radius_from_location=1, ),  # taplow
+        ZooplaPropertiesForSale(location_identifier='pinner', radius_from_location=0, ),  # pinner
+    ]
+
+    searches = rightmove_searches + zoopla_searches
+    watermarks = Watermarks(repo)
+    if incremental:
+        for search in searches:
+            search.watermark = watermarks.get(search)
+
+    checkpoints = create_checkpoints(CHECKPOINT_DIR, today)
+    listings, failed = crawl_regions(searches, checkpoints, job)
+
+    rightmove_houses = collect_listings(RightmovePropertiesForSale, listings[:len(rightmove_searches)])
+    zoopla_houses = collect_listings(ZooplaPropertiesForSale, listings[len(rightmove_searches):])
+
+    rollups = MarketRollups(repo)
+    yesterdays_rightmove_houses = store_history(repo, rightmove_houses, "rightmove", yesterday, rollups)
+    yesterdays_zoopla_houses = store_history(repo, zoopla_houses, "zoopla", yesterday, rollups)
+    rollups.save(f"Updating {MarketRollups.path} - {dt.datetime.now().strftime('%d/%m/%Y')}")
+
+    # Link the same house across portals so it is only reported once
+    matches = store_matches(repo, ListingMatcher().match(rightmove_houses, zoopla_houses))
+
+    price_reductions = ListingMatcher.merge(
+        # Listings in a region that was not crawled in full are missing, not removed
+        ListingTimeline.price_reductions(track_listings(repo, rightmove_houses, "rightmove", today, not (failed or incremental))),
+        ListingTimeline.price_reductions(track_listings(repo, zoopla_houses, "zoopla", today, not (failed or incremental))),
+        matches
+    )
+
+    for search, records in zip(searches, listings):
+        if search not in failed:
+            watermarks.update(search, records, full=search.watermark is None)
+    watermarks.save(f"Updating {Watermarks.path} - {dt.datetime.now().strftime('%d/%m/%Y')}")
+
+    repo.commit(f"Nightly run - {dt.datetime.now().strftime('%d/%m/%Y')}")
+
+    global market_rollups, spatial_index
+    market_rollups = rollups
+    # Rebuilt from the updated history on the next location search
+    spatial_index = None
+
+    # Send email
+    send_digests(repo, ListingMatcher.merge(yesterdays_rightmove_houses, yesterdays_zoopla_houses, matches), price_reductions)
+
+    checkpoints.clear()
+
+    logging.info(f"Run summary: {json.dumps(run.finish(), sort_keys=True)}")
+
+
+def send_digests(repo, listings, price_reductions):
+    subscribers = Subscriptions(repo).load()
+    if subscribers is None:
+        # Without saved searches everyone on TO_EMAIL gets the whole digest, as before
+        EmailSender(listings, price_reductions, create_email_client())
+        return
+
+    api_client = create_email_client()
+    matcher = AlertMatcher(subscribers, PostcodeDistricts())
+    for email, matched, reductions in matcher.digests(listings, price_reductions):
+        logging.info(f"Saved searches for {email} matched {len(matched)} listings")
+        EmailSender(matched, reductions, api_client, recipients=[email])
+
+
+def crawl_regions(searches, checkpoints, job):
+    # Regions checkpointed by an earlier, interrupted run of the same day are not crawled again
+    pending = [search for search in searches if not checkpoints.exists(search)]
+    if len(pending) < len(searches):
+        logging.info(f"Resuming from checkpoints: {len(searches) - len(pending)} of {len(searches)} regions already crawled")
+
+    for attempt in range(REGION_RETRIES + 1):
+        if not pending:
+            break
+
+        if attempt > 0:
+            delay = REGION_RETRY_BACKOFF * 2 ** (attempt - 1)
+            logging.warning(f"Retrying {len(pending)} failed regions in {delay:.0f}s (attempt {attempt} of {REGION_RETRIES})")
+            time.sleep(delay)
+
+        failed = []
+        crawler = create_crawler()
+        try:
+            for search, records in zip(pending, crawler.crawl(pending)):
+                try:
+                    checkpoints.save(search, list(records))
+                except Exception as error:
+                    logging.warning(f"Failed to crawl {search.portal} region {search.location_identifier}: {error!r}")
+                    failed.append(search)
+        finally:
+            crawler.close()
+
+        pending = failed
+        job.progress.update(regions_crawled=len(searches) - len(pending), regions_total=len(searches),
+                            failed_regions=[search.location_identifier for search in pending], attempts=attempt + 1)
+
+    if pending:
+        logging.error(f"Giving up on {len(pending)} regions: {', '.join(search.location_identifier for search in pending)}")
+
+    listings = [checkpoints.load(search) if checkpoints.exists(search) else [] for search in searches]
+    return listings, pending
+
+
+def create_crawler():
+    pages = os.path.join(REPLAY_DIR, "pages")
+
+    parse_pool = ParsePool(PARSE_WORKERS, PARSE_QUEUE_SIZE) if PARSE_WORKERS > 0 else None
+
+    if REPLAY_MODE == 'replay':
+        fixtures = ReplaySession(pages)
+        return CrawlScheduler(max_workers=CRAWL_MAX_WORKERS, default_limit=(CRAWL_MAX_WORKERS, 0), session_factory=lambda host: fixtures,
+                              parse_pool=parse_pool)
+
+    # Per-portal budgets: concurrent connections and requests per second
+    crawler = CrawlScheduler(
+        max_workers=CRAWL_MAX_WORKERS,
+        host_limits={
+            "www.rightmove.co.uk": HostLimit(concurrency=4, requests_per_second=2),
+            "www.zoopla.co.uk": HostLimit(concurrency=2, requests_per_second=1),
+        },
+        parse_pool=parse_pool,
+    )
+
+    sessions = crawler.create_session
+    if response_cache is not None:
+        sessions = lambda host, create=sessions: CachedSession(create(host), response_cache)
+    if REPLAY_MODE == 'record':
+        sessions = lambda host, create=sessions: RecordingSession(create(host), pages)
+    crawler.session_factory = sessions
+
+    return crawler
+
+
+def get_repository():
+    # Record and replay runs never touch the real repository or send real email
+    if REPLAY_MODE in ('record', 'replay'):
+        if REPLAY_REPOSITORY == 'git':
+            return LocalGitRepository(os.path.join(REPLAY_DIR, "repository.git"))
+        return LocalRepository(os.path.join(REPLAY_DIR, "repository"))
+
+    return repository.get()
+
+
+def create_email_client():
+    if REPLAY_MODE in ('record', 'replay'):
+        return LocalSendGridClient(os.path.join(REPLAY_DIR, "outbox"))
+
+    return None
+
+
+def collect_listings(portal, listings):
+    # Build a single frame per portal from the streamed records of every region
+    return portal.normalizer.normalize(Parser.create_data_frame(itertools.chain.from_iterable(listings)))
+
+
+def get_rollups():
+    global market_rollups
+    if market_rollups is None:
+        market_rollups = MarketRollups(get_repository())
+    return market_rollups
+
+
+def get_spatial_index():
+    global spatial_index
+    if spatial_index is None:
+        repo = get_repository()
+        listings = pd.concat([read_history(repo, portal).assign(portal=portal) for portal in ("rightmove", "zoopla")], ignore_index=True)
+
+        # A listing is stored again whenever its details change; only its latest version is searchable
+        observed = pd.to_datetime(listings["search_datetime"], format="%I:%M%p on %B %d, %Y", errors="coerce")
+        latest = listings.assign(observed=observed, listing_id=Parser.listing_ids(listings["url"])).sort_values("observed", ascending=False, kind="stable")
+        spatial_index = SpatialIndex(latest.drop_duplicates(["portal", "listing_id"]), PostcodeDistricts())
+        logging.info(f"Indexed {len(spatial_index.listings)} listings for location search, {spatial_index.unlocated} without a known postcode district")
+
+    return spatial_index
+
+
+def read_history(repo, portal):
+    if HISTORY_MODE == 'partitioned':
+        return PartitionedHistory(repo, portal, legacy_path=f"{portal}-houses.csv", file_format=HISTORY_FORMAT).read_all()
+
+    return read_csv_history(repo, f"{portal}-houses.csv")[0]
+
+
+def read_csv_history(repo, path):
+    # The contents API refuses files over 1MB, so the history is fetched as a git blob
+    with metrics.timed(metrics.GITHUB_SECONDS, operation="read"):
+        repo_csv = repo.get_contents(path)
+        encoded_blob_csv = repo.get_git_blob(repo_csv.sha)
+    decoded_blob_csv = base64.b64decode(encoded_blob_csv.content).decode('utf-8')
+    metrics.GITHUB_BYTES.inc(len(decoded_blob_csv), operation="read")
+
+    return pd.read_csv(io.StringIO(decoded_blob_csv), encoding_errors='replace'), repo_csv.sha
+
+
+def store_history(repo, new_properties, portal, yesterday, rollups=None):
+    if HISTORY_MODE == 'partitioned':
+        history = PartitionedHistory(repo, portal, legacy_path=f"{portal}-houses.csv", file_format=HISTORY_FORMAT)
+        yesterdays_properties = history.append(
+            new_properties,
+            f"Updating history/{portal} - {dt.datetime.now().strftime('%d/%m/%Y')}",
+            yesterday
+        )
+        if rollups is not None:
+            # The first run seeds the rollups from the whole history; later runs only add the rows they stored
+            rollups.update(portal, history.appended if rollups.has(portal) else history.read_all())
+        return yesterdays_properties
+
+    return process_csv(
+        repo,
+        new_properties,
+        f"{portal}-houses.csv",
+        f"Updating {portal}-houses.csv - {dt.datetime.now().strftime('%d/%m/%Y')}",
+        yesterday,
+        rollups
+    )
+
+
+def store_matches(repo, matches):
+    if HISTORY_MODE == 'partitioned':
+        return MatchHistory(repo).append(
+            matches,
+            f"Updating {MatchHistory.path} - {dt.datetime.now().strftime('%d/%m/%Y')}",
+            dt.datetime.now().strftime('%Y-%m-%d')
+        )
+
+    return matches
+
+
+def track_listings(repo, scraped, portal, today, detect_removals=True):
+    timeline = ListingTimeline(repo, portal)
+    events = timeline.update(scraped, today, detect_removals)
+    timeline.save(f"Updating history/{portal}/timeline.csv - {dt.datetime.now().strftime('%d/%m/%Y')}")
+
+    return events
+
+
+def process_csv(repo, new_properties, path, commit_message, yesterday, rollups=None):
+    history, sha = read_csv_history(repo, path)
+    csv = merge_history(history, new_properties)
+    yesterdays_properties = csv.loc[csv["added_on"] == yesterday]
+
+    added = new_rows(history, new_properties)
+    portal = path.split("-")[0]
+    # Counted per listing, as overlapping searches (and Zoopla's per-search urls) repeat the same one
+    scraped = new_properties["listing_id"].nunique()
+    metrics.DEDUP_ROWS.inc(added["listing_id"].nunique(), portal=portal, result="new")
+    metrics.DEDUP_ROWS.inc(scraped - added["listing_id"].nunique(), portal=portal, result="duplicate")
+
+    if rollups is not None:
+        rollups.update(portal, added if rollups.has(portal) else csv)
+
+    csv_format = bytes(csv.to_csv(index=False, encoding='utf-8'), encoding='utf-8')
+
+    repo.update_file(path=path, message=commit_message, content=csv_format, sha=sha)
+
+    return yesterdays_properties
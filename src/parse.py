@@ -1,21 +1,124 @@
+import re
+
 import datetime as dt
 import pandas as pd
 import pytz
 
+import metrics
 
-class Parser:
+from lxml import etree, html
+
+
+class PageExtractor:
+
+    def __init__(self, base_url: str, card: str, fields: dict[str, str], result_count: str):
+        self.base_url = base_url
+        self.card = etree.XPath(card)
+        self.fields = {name: etree.XPath(xpath) for name, xpath in fields.items()}
+        self.result_count = etree.XPath(result_count)
+
+    @staticmethod
+    def parse(page):
+        return page if isinstance(page, html.HtmlElement) else html.fromstring(page)
+
+    def records(self, tree):
+        # Evaluate every field relative to its own card so a missing field can't shift the others
+        for card in self.card(tree):
+            record = {name: self.first_text(xpath(card)) for name, xpath in self.fields.items()}
+            if record["url"] is not None:
+                record["url"] = f"{self.base_url}{record['url']}"
+            yield record
 
     @staticmethod
-    def create_data_frame(data: list[str]):
-        columns = ["price", "type", "address", "url", "added_on"]
+    def first_text(values):
+        for value in values:
+            if str(value).strip():
+                return str(value)
+        return None
+
 
-        temp_df = pd.DataFrame(data)
-        temp_df = temp_df.transpose()
+class Parser:
+    columns = ["price", "type", "address", "url", "added_on"]
+    listing_id_pattern = re.compile(r"/(?:properties|details)/(\d+)")
 
-        temp_df.columns = columns
+    @staticmethod
+    def listing_ids(urls):
+        return urls.astype(str).str.extract(Parser.listing_id_pattern, expand=False)
+
+    @staticmethod
+    def create_data_frame(records):
+        temp_df = pd.DataFrame.from_records(records, columns=Parser.columns)
         temp_df = temp_df[temp_df["address"].notnull()]
 
         london_tzinfo = pytz.timezone("Europe/London")
         temp_df["search_datetime"] = dt.datetime.now(dt.timezone.utc).astimezone(london_tzinfo).strftime("%I:%M%p on %B %d, %Y")
 
         return temp_df
+
+
+class Normalizer:
+    price_pattern = re.compile(r"\D")
+    # The last outward code in the address; flat and plot numbers like "R3.05" come earlier, postcodes come last
+    postcode_pattern = re.compile(r"^.*\b([A-Z]{1,2}[0-9][A-Z0-9]?)\b", re.IGNORECASE | re.DOTALL)
+    bedrooms_pattern = re.compile(r"\b(\d{1,2})\s*bed", re.IGNORECASE)
+    studio_pattern = re.compile(r"\bstudio\b", re.IGNORECASE)
+    relative_dates = {"today": 0, "yesterday": 1}
+
+    def __init__(self, portal: str, date_pattern: str, date_format: str, default_bedrooms: float = 1.0):
+        self.portal = portal
+        self.date_pattern = re.compile(date_pattern, re.IGNORECASE)
+        self.date_format = date_format
+        self.default_bedrooms = default_bedrooms
+
+    def normalize(self, results):
+        with metrics.timed(metrics.NORMALIZE_SECONDS, portal=self.portal):
+            kind = self.per_value(results["type"], lambda values: values.astype(str).str.strip())
+            address = results["address"].astype(str)
+
+            normalized = pd.DataFrame({
+                "price": self.per_value(results["price"], self.prices),
+                "type": kind,
+                "address": address,
+                "url": results["url"],
+                "added_on": self.per_value(results["added_on"], self.dates),
+                "search_datetime": results["search_datetime"].astype(str),
+                "postcode": self.postcodes(address),
+                "number_bedrooms": self.per_value(kind, self.bedrooms),
+                "listing_id": Parser.listing_ids(results["url"]),
+            }, index=results.index)
+
+            return normalized.sort_values("added_on", ascending=False)
+
+    @staticmethod
+    def per_value(column, func):
+        # Prices, titles and dates repeat heavily, so each distinct value is normalized once and mapped back
+        codes, uniques = pd.factorize(column, use_na_sentinel=False)
+        return pd.Series(func(pd.Series(uniques)).to_numpy()[codes], index=column.index)
+
+    def prices(self, price):
+        return pd.to_numeric(price.astype(str).str.replace(self.price_pattern, "", regex=True), errors="coerce").astype("float64")
+
+    def postcodes(self, address):
+        return address.str.extract(self.postcode_pattern, expand=False).str.upper()
+
+    def bedrooms(self, kind):
+        bedrooms = pd.to_numeric(kind.str.extract(self.bedrooms_pattern, expand=False), errors="coerce")
+        bedrooms = bedrooms.mask(kind.str.contains(self.studio_pattern), 0.0)
+        return bedrooms.fillna(self.default_bedrooms).astype("float64")
+
+    def dates(self, added_on):
+        added_on = added_on.astype(str)
+
+        today = dt.datetime.now(pytz.timezone("Europe/London")).date()
+        relative = pd.Series(pd.NaT, index=added_on.index, dtype="datetime64[ns]")
+        for word, days_ago in self.relative_dates.items():
+            relative = relative.mask(added_on.str.contains(word, case=False), pd.Timestamp(today - dt.timedelta(days=days_ago)))
+
+        # Rule patterns capture the date's parts (dropping ordinals and the like); they are rejoined with spaces for date_format
+        parts = added_on.str.extract(self.date_pattern)
+        text = parts[0]
+        for column in parts.columns[1:]:
+            text = text + " " + parts[column]
+        dates = pd.to_datetime(text, format=self.date_format, errors="coerce")
+
+        return relative.fillna(dates).astype(str)
@@ -0,0 +1,257 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import types
+
+from github import GithubException, UnknownObjectException
+
+
+class RecordingSession:
+    # Sessions for different hosts share one fixture index
+    lock = threading.Lock()
+
+    def __init__(self, session, directory: str):
+        self.session = session
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+
+        if response.status_code == 200:
+            name = f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.html"
+            with open(os.path.join(self.directory, name), "wb") as fixture:
+                fixture.write(response.content)
+
+            with self.lock:
+                index = load_index(self.index_path)
+                index[url] = name
+                with open(self.index_path, "w") as index_file:
+                    json.dump(index, index_file, indent=2, sort_keys=True)
+
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class ReplaySession:
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.index = load_index(os.path.join(directory, "index.json"))
+
+    def get(self, url, **kwargs):
+        if url not in self.index:
+            logging.warning(f"No recorded fixture for {url}")
+            return types.SimpleNamespace(url=url, status_code=404, headers={}, content=b"")
+
+        with open(os.path.join(self.directory, self.index[url]), "rb") as fixture:
+            return types.SimpleNamespace(url=url, status_code=200, headers={}, content=fixture.read())
+
+    def close(self):
+        pass
+
+
+class LocalRepository:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.blobs = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def blob_sha(content: bytes):
+        return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+    def get_contents(self, path: str):
+        full_path = os.path.join(self.root, path)
+        if not os.path.isfile(full_path):
+            raise UnknownObjectException(404, {"message": "Not Found"}, None)
+
+        with open(full_path, "rb") as file:
+            content = file.read()
+
+        sha = self.blob_sha(content)
+        self.blobs[sha] = content
+        return types.SimpleNamespace(path=path, sha=sha, decoded_content=content, size=len(content))
+
+    def get_git_blob(self, sha: str):
+        if sha not in self.blobs:
+            raise UnknownObjectException(404, {"message": "Not Found"}, None)
+        return types.SimpleNamespace(sha=sha, content=base64.b64encode(self.blobs[sha]).decode("ascii"), encoding="base64")
+
+    def create_file(self, path: str, message: str, content, **kwargs):
+        with self.lock:
+            if os.path.isfile(os.path.join(self.root, path)):
+                raise GithubException(422, {"message": "\"sha\" wasn't supplied."}, None)
+            return self._write(path, message, content)
+
+    def update_file(self, path: str, message: str, content, sha: str, **kwargs):
+        with self.lock:
+            current = self.get_contents(path)
+            if current.sha != sha:
+                raise GithubException(409, {"message": f"{path} does not match {sha}"}, None)
+            return self._write(path, message, content)
+
+    def _write(self, path: str, message: str, content):
+        if isinstance(content, str):
+            content = bytes(content, encoding='utf-8')
+
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as file:
+            file.write(content)
+
+        logging.info(f"Local commit to {path}: {message}")
+
+        sha = self.blob_sha(content)
+        self.blobs[sha] = content
+        return {"content": types.SimpleNamespace(path=path, sha=sha), "commit": types.SimpleNamespace(message=message)}
+
+
+class LocalGitRepository:
+    # A bare git repository behind the subset of the GitHub contents and Git Data APIs the app uses
+
+    def __init__(self, path: str, default_branch: str = "main"):
+        self.path = path
+        self.default_branch = default_branch
+        if not os.path.isdir(path):
+            subprocess.run(["git", "init", "--quiet", "--bare", f"--initial-branch={default_branch}", path], check=True)
+
+    def git(self, *args, input: bytes = None, env=None):
+        result = subprocess.run(["git", "--git-dir", self.path, *args], input=input, capture_output=True,
+                                env={**os.environ, "GIT_AUTHOR_NAME": "property-tracking", "GIT_AUTHOR_EMAIL": "property-tracking@localhost",
+                                     "GIT_COMMITTER_NAME": "property-tracking", "GIT_COMMITTER_EMAIL": "property-tracking@localhost", **(env or {})})
+        if result.returncode != 0:
+            raise GithubException(422, {"message": result.stderr.decode("utf-8", "replace").strip()}, None)
+        return result.stdout
+
+    def head(self):
+        try:
+            return self.git("rev-parse", "--verify", "--quiet", f"refs/heads/{self.default_branch}").decode("ascii").strip()
+        except GithubException:
+            return None
+
+    def get_contents(self, path: str, ref: str = None):
+        try:
+            sha = self.git("rev-parse", "--verify", "--quiet", f"{ref or self.default_branch}:{path}").decode("ascii").strip()
+        except GithubException:
+            raise UnknownObjectException(404, {"message": "Not Found"}, None)
+
+        content = self.git("cat-file", "blob", sha)
+        return types.SimpleNamespace(path=path, sha=sha, decoded_content=content, size=len(content))
+
+    def get_git_blob(self, sha: str):
+        try:
+            content = self.git("cat-file", "blob", sha)
+        except GithubException:
+            raise UnknownObjectException(404, {"message": "Not Found"}, None)
+        return types.SimpleNamespace(sha=sha, content=base64.b64encode(content).decode("ascii"), encoding="base64")
+
+    def create_file(self, path: str, message: str, content, **kwargs):
+        if self.head() is not None and self.tree_entries(self.head()).get(path) is not None:
+            raise GithubException(422, {"message": "\"sha\" wasn't supplied."}, None)
+        return self.commit_file(path, message, content)
+
+    def update_file(self, path: str, message: str, content, sha: str, **kwargs):
+        if self.head() is None or self.tree_entries(self.head()).get(path) != sha:
+            raise GithubException(409, {"message": f"{path} does not match {sha}"}, None)
+        return self.commit_file(path, message, content)
+
+    def commit_file(self, path: str, message: str, content):
+        if isinstance(content, str):
+            content = bytes(content, encoding='utf-8')
+
+        # Like the contents API: one commit per file
+        blob = self.create_git_blob(base64.b64encode(content).decode("ascii"), "base64")
+        parent = self.head()
+        base_tree = self.get_git_commit(parent).tree if parent else None
+        tree = self.create_git_tree([{"path": path, "mode": "100644", "type": "blob", "sha": blob.sha}], base_tree=base_tree)
+        commit = self.create_git_commit(message, tree, [self.get_git_commit(parent)] if parent else [])
+        self.git("update-ref", f"refs/heads/{self.default_branch}", commit.sha, parent or "")
+
+        return {"content": types.SimpleNamespace(path=path, sha=blob.sha), "commit": commit}
+
+    def get_git_ref(self, ref: str):
+        name = f"refs/{ref}"
+        sha = self.git("rev-parse", "--verify", name).decode("ascii").strip()
+
+        # Like GitHub, a non-forced update only succeeds while the ref still points where we read it
+        def edit(new_sha, force=False):
+            self.git("update-ref", name, new_sha, *([] if force else [sha]))
+
+        return types.SimpleNamespace(ref=name, object=types.SimpleNamespace(sha=sha), edit=edit)
+
+    def get_git_commit(self, sha: str):
+        tree = self.git("rev-parse", f"{sha}^{{tree}}").decode("ascii").strip()
+        return types.SimpleNamespace(sha=sha, tree=types.SimpleNamespace(sha=tree))
+
+    def get_git_tree(self, sha: str, recursive=False):
+        entries = self.tree_entries(sha, recursive)
+        return types.SimpleNamespace(sha=sha, tree=[types.SimpleNamespace(path=path, sha=blob) for path, blob in entries.items()])
+
+    def tree_entries(self, treeish: str, recursive=True):
+        listing = self.git("ls-tree", *(["-r"] if recursive else []), "-z", treeish).decode("utf-8")
+        entries = {}
+        for line in filter(None, listing.split("\0")):
+            meta, path = line.split("\t", 1)
+            entries[path] = meta.split()[2]
+        return entries
+
+    def create_git_blob(self, content: str, encoding: str):
+        data = base64.b64decode(content) if encoding == "base64" else content.encode("utf-8")
+        sha = self.git("hash-object", "-w", "--stdin", input=data).decode("ascii").strip()
+        return types.SimpleNamespace(sha=sha)
+
+    def create_git_tree(self, tree, base_tree=None):
+        # Build the tree in a throwaway index so nested paths and the base tree are merged by git itself
+        with tempfile.TemporaryDirectory() as directory:
+            env = {"GIT_INDEX_FILE": os.path.join(directory, "index")}
+            if base_tree is not None:
+                self.git("read-tree", base_tree.sha, env=env)
+            else:
+                self.git("read-tree", "--empty", env=env)
+
+            for element in tree:
+                element = element if isinstance(element, dict) else element._identity
+                self.git("update-index", "--add", "--cacheinfo", f"{element['mode']},{element['sha']},{element['path']}", env=env)
+            sha = self.git("write-tree", env=env).decode("ascii").strip()
+
+        return types.SimpleNamespace(sha=sha)
+
+    def create_git_commit(self, message: str, tree, parents):
+        parent_args = [arg for parent in parents for arg in ("-p", parent.sha)]
+        sha = self.git("commit-tree", tree.sha, *parent_args, input=message.encode("utf-8")).decode("ascii").strip()
+        return types.SimpleNamespace(sha=sha, message=message)
+
+
+class LocalSendGridClient:
+
+    def __init__(self, outbox: str):
+        self.outbox = outbox
+        os.makedirs(outbox, exist_ok=True)
+
+    def send(self, message):
+        mail = message.get()
+        name = hashlib.sha1(json.dumps(mail, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+        with open(os.path.join(self.outbox, f"{name}.json"), "w") as file:
+            json.dump(mail, file, indent=2)
+
+        logging.info(f"Saved email to {self.outbox}/{name}.json")
+        return types.SimpleNamespace(status_code=202, body=b"", headers={})
+
+
+def load_index(path: str):
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path) as index_file:
+        return json.load(index_file)
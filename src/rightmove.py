@@ -1,25 +1,41 @@
-import time
 import urllib.parse
 import logging
 import requests
 import math
 
-import datetime as dt
-import pandas as pd
-
-from lxml import html
-from parse import Parser
+import metrics
+from parse import Normalizer, Parser, PageExtractor
 
 
 class RightmovePropertiesForSale:
+    portal = "rightmove"
     headers = {'User-Agent': 'Google', 'Accept-Language': 'en-gb', 'Referer': 'https://www.google.com/'}
+    extractor = PageExtractor(
+        base_url="https://www.rightmove.co.uk",
+        card="""//div[contains(concat(" ", normalize-space(@class), " "), " propertyCard ")]""",
+        fields={
+            "price": """.//div[@class="propertyCard-priceValue"]/text()""",
+            "type": """.//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]//h2[@class="propertyCard-title"]/text()""",
+            "address": """.//address[@class="propertyCard-address"]//span/text()""",
+            "url": """.//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]/@href""",
+            "added_on": """.//div[@class="propertyCard-detailsFooter"]//span[@class="propertyCard-branchSummary-addedOrReduced"]/text()""",
+        },
+        result_count="""//span[@class="searchHeader-resultCount"]/text()""",
+    )
+
+    normalizer = Normalizer(
+        portal="rightmove",
+        date_pattern=r"\b([0-9]{1,2}/[0-9]{1,2}/[0-9]{4})\b",
+        date_format="%d/%m/%Y",
+    )
 
     def __init__(self, location_identifier: str,
                  min_price: int = 375_000,
                  max_price: int = 650_000,
                  radius_from_location: float = 0,
                  property_type: list[str] = 'houses',
-                 include_sstc: bool = True):
+                 include_sstc: bool = True,
+                 session=requests):
         self.parser = Parser()
         self.base_url = 'https://www.rightmove.co.uk/property-for-sale/find.html'
         self.location_identifier = location_identifier
@@ -28,11 +44,43 @@ class RightmovePropertiesForSale:
         self.radius_from_location = radius_from_location
         self.property_type = property_type
         self.include_sstc = include_sstc
+        self.session = session
 
-        self.current_page = self._request(0)
+        self.current_page = None
+        self.watermark = None
 
     def parse_site(self):
-        return self.process_results()
+        return self.process_results(self.listings(self.pages()))
+
+    def pages(self):
+        self.current_page = self.first_page()
+        yield self.current_page
+
+        if self.watermark is not None:
+            yield from self.newer_pages(self.current_page)
+            return
+
+        for index in self.page_indexes():
+            yield self._request(index)
+
+    def newer_pages(self, page):
+        # Results are sorted newest first, so paging stops at the first page with nothing past the watermark
+        for index in self.page_indexes():
+            if not self.watermark.has_unseen(record["url"] for record in self.extractor.records(page)):
+                return
+
+            page = self.extractor.parse(self._request(index))
+            yield page
+
+    def listings(self, pages):
+        for page in pages:
+            yield from self.process_page(page)
+
+    def first_page(self):
+        return self.extractor.parse(self._request(0))
+
+    def page_indexes(self):
+        return [p * 24 for p in range(1, self.number_of_pages, 1)]
 
     def create_url(self, index: int = 0):
         url_vars = {
@@ -44,94 +92,37 @@ class RightmovePropertiesForSale:
             "primaryDisplayPropertyType": self.property_type,
             "includeSSTC": self.include_sstc,
         }
+        if self.watermark is not None:
+            url_vars["sortType"] = 6
         return "{}?{}".format(self.base_url, urllib.parse.urlencode(url_vars))
 
     def _request(self, index):
-        self.url = self.create_url(index)
+        url = self.create_url(index)
 
-        logging.info(f"Making request to {self.url}")
+        logging.info(f"Making request to {url}")
 
-        r = requests.get(self.url, headers=self.headers)
+        r = self.session.get(url, headers=self.headers)
         if r.status_code != 200:
+            metrics.REQUEST_ERRORS.inc(portal=self.portal, status=r.status_code)
             raise ValueError(f"Cannot make request to rightmove.co.uk. Returned status: {r.status_code} with error: {r.headers, r.content}")
-        return r.content
-
-    def process_results(self):
-        no_of_pages = self.number_of_pages
-        logging.info(f"Processing {no_of_pages} pages on {self.base_url} for {self.location_identifier}")
-
-        results = self.process_page()
 
-        for p in range(1, no_of_pages, 1):
-            current_index = p * 24
-
-            self.current_page = self._request(current_index)
-            results = pd.concat([results, self.process_page()])
-
-        results["price"].replace(regex=True, inplace=True, to_replace=r"\D", value=r"")
-        results["price"] = pd.to_numeric(results["price"])
-
-        # Extract postcodes to a separate column:
-        postcode_regex = r"\b([A-Za-z][A-Za-z]?[0-9][0-9]?[A-Za-z]?)\b"
-        results["address"] = results["address"].astype(str)
-        results["postcode"] = results["address"].str.extract(postcode_regex, expand=True)
-
-        # Extract number of bedrooms from `type` to a separate column:
-        no_of_bedroom_regex = r"\b([\d][\d]?)\b"
-        no_of_bedrooms = results["type"].astype(str).str.extract(no_of_bedroom_regex, expand=True)
-        if no_of_bedrooms is None:
-            no_of_bedrooms = 1.0
-        results["number_bedrooms"] = no_of_bedrooms
-        results.loc[results["type"].str.contains("studio", case=False), "number_bedrooms"] = 0
-        results["number_bedrooms"] = pd.to_numeric(results["number_bedrooms"])
-
-        # Extract the date the property was added on to rightmove
-        date_added_regex = r"\b([0-9]{1,2}\/[0-9]{1,2}\/[0-9]{1,4})\b"
-        today = dt.datetime.now().strftime("%d/%m/%Y")
-        yesterday = (dt.datetime.today() - dt.timedelta(days=1)).strftime("%d/%m/%Y")
-        results["added_on"] = results["added_on"].astype(str).str.replace('today', today)
-        results["added_on"] = results["added_on"].astype(str).str.replace('yesterday', yesterday)
-        results["added_on"] = results["added_on"].astype(str).str.extract(date_added_regex, expand=True)
-
-        # Clean up annoying white spaces and newlines in `type` column:
-        results["type"] = results["type"].astype(str).str.strip("\n").str.strip()
-
-        results["search_datetime"] = results["search_datetime"].astype('str')
-
-        results["added_on"] = results["added_on"].astype('str')
-
-        results.sort_values("added_on", ascending=False, inplace=True)
+        metrics.PAGES_FETCHED.inc(portal=self.portal)
+        metrics.BYTES_DOWNLOADED.inc(len(r.content), portal=self.portal)
+        return r.content
 
-        time.sleep(1)
+    def process_results(self, listings):
+        results = self.normalizer.normalize(self.parser.create_data_frame(listings))
+        logging.info(f"Processed {len(results)} listings on {self.base_url} for {self.location_identifier}")
 
         return results
 
-    def process_page(self):
-        tree = html.fromstring(self.current_page)
-
-        base = "https://www.rightmove.co.uk"
-        xp_titles = """//div[@class="propertyCard-details"]\
-                //a[@class="propertyCard-link"]\
-                //h2[@class="propertyCard-title"]/text()"""
-        xp_prices = """//div[@class="propertyCard-priceValue"]/text()"""
-        xp_addresses = """//address[@class="propertyCard-address"]//span/text()"""
-        xp_weblinks = """//div[@class="propertyCard-details"]//a[@class="propertyCard-link"]/@href"""
-        xp_added_on = """//div[@class="propertyCard-detailsFooter"]//span[@class="propertyCard-branchSummary-addedOrReduced"]/text()"""
-
-        # Create data lists from xpaths:
-        price = tree.xpath(xp_prices)
-        if price is None:
-            price = '0'
-        titles = tree.xpath(xp_titles)
-        addresses = tree.xpath(xp_addresses)
-        weblinks = [f"{base}{tree.xpath(xp_weblinks)[w]}" for w in range(len(tree.xpath(xp_weblinks)))]
-        added_on = tree.xpath(xp_added_on)
-
-        data = [price, titles, addresses, weblinks, added_on]
-        return self.parser.create_data_frame(data)
+    def process_page(self, page):
+        with metrics.timed(metrics.PARSE_SECONDS, portal=self.portal):
+            records = list(self.extractor.records(self.extractor.parse(page)))
+
+        metrics.ROWS_EXTRACTED.inc(len(records), portal=self.portal)
+        return records
 
     @property
     def number_of_pages(self):
-        tree = html.fromstring(self.current_page)
-        xpath = """//span[@class="searchHeader-resultCount"]/text()"""
-        return math.ceil(int(tree.xpath(xpath)[0].replace(",", "")) / 24)
+        return math.ceil(int(self.extractor.result_count(self.current_page)[0].replace(",", "")) / 24)
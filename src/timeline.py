@@ -0,0 +1,128 @@
+import io
+import logging
+
+import pandas as pd
+
+from history import read_file, write_file
+
+
+class ListingTimeline:
+    ACTIVE = "active"
+    REMOVED = "removed"
+
+    NEW = "new"
+    PRICE_REDUCED = "price_reduced"
+    PRICE_INCREASED = "price_increased"
+    RELISTED = "relisted"
+    DELISTED = "removed"
+
+    columns = ["portal", "url", "address", "postcode", "number_bedrooms", "first_seen", "last_seen", "status", "price",
+               "previous_price", "price_changed_on", "removed_on", "relisted_on", "price_history"]
+
+    def __init__(self, repo, portal: str):
+        self.repo = repo
+        self.portal = portal
+        self.path = f"history/{portal}/timeline.csv"
+        self.state = None
+        self.sha = None
+
+    def load(self):
+        if self.state is not None:
+            return self.state
+
+        content, self.sha = read_file(self.repo, self.path)
+        if content is None:
+            self.state = pd.DataFrame(columns=self.columns, index=pd.Index([], name="listing_id", dtype="object"))
+        else:
+            # Timelines saved before a column was added get it empty; it fills in as listings are seen again
+            self.state = pd.read_csv(io.BytesIO(content), dtype={"listing_id": str}).set_index("listing_id").reindex(columns=self.columns)
+
+        return self.state
+
+    def update(self, scraped, today: str, detect_removals: bool = True):
+        state = self.load()
+
+        current = scraped[scraped["listing_id"].notnull()].drop_duplicates(subset=["listing_id"]).set_index("listing_id")
+        current_price = pd.to_numeric(current["price"], errors="coerce")
+
+        new_ids = current.index.difference(state.index)
+        seen_ids = current.index.intersection(state.index)
+
+        previous_price = pd.to_numeric(state.loc[seen_ids, "price"], errors="coerce")
+        changed = current_price.loc[seen_ids].notnull() & current_price.loc[seen_ids].ne(previous_price)
+        changed_ids = seen_ids[changed.values]
+        relisted_ids = seen_ids[(state.loc[seen_ids, "status"] == self.REMOVED).values]
+
+        # Only a full crawl can tell that an active listing has disappeared
+        removed_ids = pd.Index([])
+        if detect_removals:
+            missing = state.index.difference(current.index)
+            removed_ids = missing[(state.loc[missing, "status"] == self.ACTIVE).values]
+
+        events = [
+            self.events(current.loc[new_ids], self.NEW, None),
+            self.events(current.loc[changed_ids], None, previous_price.loc[changed_ids]),
+            self.events(current.loc[relisted_ids], self.RELISTED, previous_price.loc[relisted_ids]),
+            self.events(state.loc[removed_ids], self.DELISTED, None),
+        ]
+
+        # Apply the night's changes to the state in place, touching only affected rows
+        state.loc[changed_ids, "previous_price"] = previous_price.loc[changed_ids]
+        state.loc[changed_ids, "price_changed_on"] = today
+        state.loc[changed_ids, "price_history"] = state.loc[changed_ids, "price_history"].astype(str) + \
+            f";{today}:" + current_price.loc[changed_ids].map(lambda price: f"{price:.0f}")
+        state.loc[relisted_ids, "relisted_on"] = today
+        state.loc[removed_ids, "status"] = self.REMOVED
+        state.loc[removed_ids, "removed_on"] = today
+
+        for column in ["url", "address", "postcode", "number_bedrooms"]:
+            state.loc[seen_ids, column] = current.loc[seen_ids, column]
+        state.loc[seen_ids, "price"] = current_price.loc[seen_ids].where(current_price.loc[seen_ids].notnull(), previous_price)
+        state.loc[seen_ids, "status"] = self.ACTIVE
+        state.loc[seen_ids, "last_seen"] = today
+
+        added = pd.DataFrame({
+            "portal": self.portal,
+            "url": current.loc[new_ids, "url"],
+            "address": current.loc[new_ids, "address"],
+            "postcode": current.loc[new_ids, "postcode"],
+            "number_bedrooms": current.loc[new_ids, "number_bedrooms"],
+            "first_seen": today,
+            "last_seen": today,
+            "status": self.ACTIVE,
+            "price": current_price.loc[new_ids],
+            "price_history": f"{today}:" + current_price.loc[new_ids].map(lambda price: f"{price:.0f}"),
+        }, index=new_ids, columns=self.columns)
+        self.state = pd.concat([state, added])
+        self.state.index.name = "listing_id"
+
+        events = pd.concat(events).reset_index(drop=True)
+        logging.info(f"{self.portal} timeline: {len(new_ids)} new, {len(changed_ids)} price changes, "
+                     f"{len(relisted_ids)} relisted, {len(removed_ids)} removed")
+
+        return events
+
+    def events(self, rows, event, previous_price):
+        price = pd.to_numeric(rows["price"], errors="coerce")
+        frame = pd.DataFrame({
+            "listing_id": rows.index,
+            "portal": self.portal,
+            "event": event,
+            "address": rows["address"].values,
+            "postcode": rows["postcode"].values,
+            "number_bedrooms": rows["number_bedrooms"].values,
+            "url": rows["url"].values,
+            "price": price.values,
+            "previous_price": None if previous_price is None else previous_price.values,
+        })
+        if event is None:
+            frame["event"] = (frame["price"] < frame["previous_price"]).map({True: self.PRICE_REDUCED, False: self.PRICE_INCREASED})
+        return frame
+
+    def save(self, commit_message):
+        self.sha = write_file(self.repo, self.path, self.state.reset_index().to_csv(index=False), self.sha, commit_message)
+
+    @classmethod
+    def price_reductions(cls, events):
+        reductions = events[events["event"] == cls.PRICE_REDUCED]
+        return reductions.assign(price_change=reductions["price"] - reductions["previous_price"]).sort_values("price_change")
@@ -0,0 +1,62 @@
+import datetime as dt
+import json
+import logging
+
+from history import read_file, write_file
+from parse import Parser
+
+
+class Watermark:
+
+    def __init__(self, last_run: str, seen: set):
+        self.last_run = last_run
+        self.seen = seen
+
+    def has_unseen(self, urls):
+        for url in urls:
+            match = Parser.listing_id_pattern.search(url or "")
+            if match is not None and match.group(1) not in self.seen:
+                return True
+        return False
+
+
+class Watermarks:
+    path = "history/watermarks.json"
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.marks = None
+        self.sha = None
+
+    def load(self):
+        if self.marks is None:
+            content, self.sha = read_file(self.repo, self.path)
+            self.marks = {} if content is None else json.loads(content)
+        return self.marks
+
+    @staticmethod
+    def key(search):
+        return f"{search.portal}:{search.location_identifier}"
+
+    def get(self, search):
+        mark = self.load().get(self.key(search))
+        if mark is None:
+            return None
+        return Watermark(mark["last_run"], set(mark["seen"]))
+
+    def update(self, search, records, full: bool):
+        ids = {match.group(1) for match in (Parser.listing_id_pattern.search(record["url"] or "") for record in records) if match}
+
+        # A full crawl sees every live listing, so it replaces the seen set rather than growing it
+        previous = self.get(search)
+        if not full and previous is not None:
+            ids |= previous.seen
+
+        self.load()[self.key(search)] = {
+            "last_run": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+            "seen": sorted(ids),
+        }
+
+    def save(self, commit_message):
+        logging.info(f"Saving watermarks for {len(self.marks)} searches")
+        self.sha = write_file(self.repo, self.path, json.dumps(self.marks, indent=1, sort_keys=True), self.sha, commit_message)
@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import nightly  # noqa: E402
+from alerts import AlertMatcher  # noqa: E402
+from geo import PostcodeDistricts  # noqa: E402
+from replay import LocalRepository  # noqa: E402
+from timeline import ListingTimeline  # noqa: E402
+
+SUBSCRIBERS = [
+    {"email": "ruislip@example.com", "searches": [{"postcodes": ["HA4"], "max_price": 500000}]},
+    {"email": "amersham@example.com", "searches": [{"near": "HP6", "radius_miles": 2, "min_bedrooms": 3}]},
+    {"email": "anywhere@example.com", "searches": [{"max_price": 1000000}]},
+]
+
+
+def scraped(prices):
+    listings = pd.DataFrame([
+        ("1", "HA4", 2, "1 Field Way, Ruislip, HA4"),
+        ("2", "HP6", 4, "2 Hill Road, Amersham, HP6"),
+        ("3", "N20", 3, "3 High Road, Whetstone, N20"),
+    ], columns=["listing_id", "postcode", "number_bedrooms", "address"])
+    listings["url"] = "https://www.rightmove.co.uk/properties/" + listings["listing_id"]
+    listings["price"] = prices
+    listings["added_on"] = "2026-10-17"
+    return listings
+
+
+def price_reductions(repo):
+    timeline = ListingTimeline(repo, "rightmove")
+    timeline.update(scraped([520000.0, 800000.0, 600000.0]), "2026-10-17")
+    return ListingTimeline.price_reductions(timeline.update(scraped([495000.0, 750000.0, 600000.0]), "2026-10-18"))
+
+
+def test_price_reductions_match_saved_searches(tmp_path):
+    reductions = price_reductions(LocalRepository(str(tmp_path)))
+    matcher = AlertMatcher(SUBSCRIBERS, PostcodeDistricts())
+
+    digests = {email: (listings, reduced) for email, listings, reduced in matcher.digests(scraped([495000.0, 750000.0, 600000.0]).iloc[0:0], reductions)}
+
+    assert list(digests["ruislip@example.com"][1]["listing_id"]) == ["1"]
+    assert list(digests["amersham@example.com"][1]["listing_id"]) == ["2"]
+    assert sorted(digests["anywhere@example.com"][1]["listing_id"]) == ["1", "2"]
+
+
+def test_rows_without_a_postcode_only_reach_searches_without_one():
+    listings = scraped([450000.0, 450000.0, 450000.0])
+    listings.loc[0, "postcode"] = None
+    matcher = AlertMatcher(SUBSCRIBERS, PostcodeDistricts())
+
+    assert dict(matcher.match(listings)) == {"amersham@example.com": {1}, "anywhere@example.com": {0, 1, 2}}
+    assert dict(matcher.match(listings.drop(columns="postcode"))) == {"anywhere@example.com": {0, 1, 2}}
+
+
+def test_send_digests_with_subscriptions_and_price_reductions(tmp_path, monkeypatch):
+    repo = LocalRepository(str(tmp_path))
+    repo.create_file(path="subscriptions.json", message="Add saved searches", content=json.dumps(SUBSCRIBERS))
+    reductions = price_reductions(repo)
+
+    sent = {}
+    monkeypatch.setattr(nightly, "EmailSender", lambda listings, reduced, api_client=None, recipients=None: sent.update({recipients[0]: (listings, reduced)}))
+    monkeypatch.setattr(nightly, "create_email_client", lambda: None)
+
+    nightly.send_digests(repo, scraped([495000.0, 750000.0, 600000.0]), reductions)
+
+    assert sorted(sent) == ["amersham@example.com", "anywhere@example.com", "ruislip@example.com"]
+    assert list(sent["ruislip@example.com"][0]["listing_id"]) == ["1"]
+    assert list(sent["ruislip@example.com"][1]["listing_id"]) == ["1"]
+    assert list(sent["anywhere@example.com"][0]["listing_id"]) == ["1", "2", "3"]
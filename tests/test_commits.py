@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pytest
+from github import GithubException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from commits import BatchedRepository  # noqa: E402
+from replay import LocalGitRepository  # noqa: E402
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = LocalGitRepository(str(tmp_path / "repository.git"))
+    repo.create_file(path="rightmove-houses.csv", message="Add rightmove history", content="price\n450000\n")
+    repo.create_file(path="zoopla-houses.csv", message="Add zoopla history", content="price\n500000\n")
+    return repo
+
+
+def log(repo):
+    return repo.git("log", "--format=%s", repo.default_branch).decode("utf-8").splitlines()
+
+
+def stage_run(repo):
+    batched = BatchedRepository(repo, retry_delay=0)
+    contents = batched.get_contents("rightmove-houses.csv")
+    batched.update_file(path="rightmove-houses.csv", message="Updating rightmove-houses.csv", content="price\n475000\n", sha=contents.sha)
+    batched.create_file(path="history/watermarks.json", message="Updating history/watermarks.json", content="{}")
+    return batched
+
+
+def test_run_lands_as_one_fast_forward_commit(repo):
+    head = repo.head()
+    sha = stage_run(repo).commit("Nightly run")
+
+    assert repo.head() == sha
+    assert repo.git("rev-parse", f"{sha}^").decode("ascii").strip() == head
+    assert log(repo) == ["Nightly run", "Add zoopla history", "Add rightmove history"]
+    assert repo.get_contents("rightmove-houses.csv").decoded_content == b"price\n475000\n"
+    assert repo.get_contents("history/watermarks.json").decoded_content == b"{}"
+
+
+def test_run_rebases_onto_an_unrelated_commit(repo, monkeypatch):
+    batched = stage_run(repo)
+
+    # Another commit lands after the run has read the branch but before it moves it
+    create_git_commit = repo.create_git_commit
+
+    def concurrent_commit(*args, **kwargs):
+        monkeypatch.setattr(repo, "create_git_commit", create_git_commit)
+        repo.update_file(path="zoopla-houses.csv", message="Concurrent zoopla update", content="price\n510000\n",
+                         sha=repo.get_contents("zoopla-houses.csv").sha)
+        return create_git_commit(*args, **kwargs)
+
+    monkeypatch.setattr(repo, "create_git_commit", concurrent_commit)
+    sha = batched.commit("Nightly run")
+
+    assert repo.head() == sha
+    assert log(repo)[:2] == ["Nightly run", "Concurrent zoopla update"]
+    assert repo.get_contents("zoopla-houses.csv").decoded_content == b"price\n510000\n"
+    assert repo.get_contents("rightmove-houses.csv").decoded_content == b"price\n475000\n"
+
+
+def test_run_fails_with_409_when_another_commit_changed_its_files(repo):
+    batched = stage_run(repo)
+    repo.update_file(path="rightmove-houses.csv", message="Concurrent rightmove update", content="price\n460000\n",
+                     sha=repo.get_contents("rightmove-houses.csv").sha)
+    head = repo.head()
+
+    with pytest.raises(GithubException) as error:
+        batched.commit("Nightly run")
+
+    assert error.value.status == 409
+    assert repo.head() == head
+    assert repo.get_contents("rightmove-houses.csv").decoded_content == b"price\n460000\n"